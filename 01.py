@@ -12,36 +12,122 @@
 #These instructions are taken from the sample script in the manual on p. 245 or 12-23. Use a carriage return and rate 9600. 
 import serial
 import time
+import asyncio
+from contextlib import contextmanager
+
+# Longest single write a batch is joined into, keeps clear of the 2400 input buffer size.
+MAX_BATCH_LENGTH = 250
+
+# Extra time (in s) some commands need after the 2400 reports them complete,
+# e.g. the source settling after the output is switched on. Commands not listed
+# here only wait for *OPC? when sent with sync=True.
+COMMAND_SETTLING_TIME = {
+    ":OUTPUT ON": 0.01,
+    ":SOUR:VOLT": 0.005,
+}
 
 class Keithley2400(object):
     """This class represents a Keithley 4 wire resistance / source meter"""
 
-    def __init__(self, port=9):
+    def __init__(self, port=9, timeout=1, opc_timeout=10):
         #port 9 is for the USB dongle.
         self.port = port
-        self.ser =serial.Serial(self.port, baudrate=9600, stopbits=serial.STOPBITS_ONE,timeout=1)
-        time.sleep(2)
+        self.opc_timeout = opc_timeout
+        self._queue = None
+        self.ser =serial.Serial(self.port, baudrate=9600, stopbits=serial.STOPBITS_ONE,timeout=timeout)
+        # instead of sleeping until the port is up, drop whatever is in the buffers
+        # and wait until the instrument answers
+        self.ser.reset_input_buffer()
+        self.ser.reset_output_buffer()
+        self.waitForCompletion()
 
     def close(self):
         self.ser.close()
 
-    def sendValue(self,string):
-        self.ser.write(string+"\r")
-        time.sleep(0.2)
+    def settlingTime(self, string):
+        """returns the extra settling time for a command from COMMAND_SETTLING_TIME"""
+        for command, delay in COMMAND_SETTLING_TIME.items():
+            if string.upper().startswith(command):
+                return delay
+        return 0
+
+    def sendValue(self, string, sync=False):
+        """writes a command. With sync=True it blocks until the instrument reports
+        the command complete (*OPC?). Only commands listed in COMMAND_SETTLING_TIME sleep.
+        Inside a batch() block plain commands are queued instead of written."""
+        if self._queue is not None:
+            if not sync and "?" not in string:
+                self._queue.append(string)
+                return
+            self.flush()
+        self.ser.write((string+"\r").encode())
+        if sync:
+            self.waitForCompletion()
+        delay = self.settlingTime(string)
+        if delay:
+            time.sleep(delay)
 
     def readValue(self, string):
+        """writes a query and returns the reply. readline returns at the terminator,
+        or after the serial timeout if there is no reply."""
         self.sendValue(string)
-        answer = self.ser.readline()
-        time.sleep(0.2)
+        answer = self.ser.readline().decode()
         return answer
+
+    @contextmanager
+    def batch(self):
+        """collects the commands sent inside the with block and writes them joined
+        with ';' (as few writes as MAX_BATCH_LENGTH allows). The error queue is
+        read once at the end with :SYST:ERR:ALL? and an IOError is raised if it
+        holds anything."""
+        self._queue = []
+        try:
+            yield self
+            self.flush()
+        finally:
+            self._queue = None
+        errors = self.readValue(":SYST:ERR:ALL?").strip()
+        if not errors.startswith("0,"):
+            raise IOError("Keithley on port %s reported: %s" % (self.port, errors))
+
+    def flush(self):
+        """writes the commands queued by batch(). Does nothing outside a batch() block,
+        where commands are written as they are sent."""
+        if self._queue is None:
+            return
+        queue, self._queue = self._queue, None
+        chunk = ""
+        for string in queue:
+            if not string.startswith((":", "*")):
+                string = ":" + string
+            if chunk and len(chunk) + len(string) + 1 > MAX_BATCH_LENGTH:
+                self.sendValue(chunk)
+                chunk = ""
+            chunk = string if not chunk else chunk + ";" + string
+        if chunk:
+            self.sendValue(chunk)
+        for string in queue:
+            delay = self.settlingTime(string)
+            if delay:
+                time.sleep(delay)
+        self._queue = []
+
+    def waitForCompletion(self):
+        """blocks until all pending commands are done, using *OPC?. Raises an IOError
+        if the instrument does not answer within opc_timeout seconds."""
+        self.ser.write(b"*OPC?\r")
+        deadline = time.time() + self.opc_timeout
+        while time.time() < deadline:
+            if self.ser.readline().strip() == b"1":
+                return
+        raise IOError("Keithley on port %s did not answer *OPC?" % self.port)
         
     def setComplianceCurrent(self, curr = 10):
         self.sendValue(":SENS:CURR:PROT " + str(curr) + "E-3")
 
 
     def reset(self):
-        self.sendValue("*RST")
-        time.sleep(1)
+        self.sendValue("*RST", sync=True)
 
     def setSourceFunc(self, func="VOLT"):
         """set the source function. can be VOLT for a voltage source or CURR for a current source"""
@@ -73,21 +159,80 @@ class Keithley2400(object):
         self.outputOff()
         return val
         
+    async def acquireBuffered(self, points, pollInterval=0.05, timeout=60):
+        """fills the trace buffer with points readings and returns them as a list of floats.
+        Buffer full (bit 9 of the measurement event register) is routed to the status byte.
+        RS-232 has no SRQ line, so *STB? is polled with asyncio.sleep in between. All serial
+        I/O runs in the default executor, so other coroutines keep running meanwhile."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.armBuffer, points)
+        deadline = time.time() + timeout
+        while not int((await loop.run_in_executor(None, self.readValue, "*STB?")).strip() or 0) & 64:
+            if time.time() > deadline:
+                await loop.run_in_executor(None, self.abortBuffer)
+                raise IOError("Keithley on port %s did not fill the buffer within %s s" % (self.port, timeout))
+            await asyncio.sleep(pollInterval)
+        return await loop.run_in_executor(None, self.readBuffer, points)
+
+    def armBuffer(self, points):
+        """clears the trace buffer, arms it for points readings with buffer full routed
+        to the status byte, switches the output on and starts the measurement"""
+        with self.batch():
+            self.sendValue("*CLS")
+            self.sendValue(":TRAC:CLE")
+            self.sendValue(":TRAC:POIN " + str(points))
+            self.sendValue(":TRAC:FEED SENS")
+            self.sendValue(":TRAC:FEED:CONT NEXT")
+            self.sendValue(":TRIG:COUN " + str(points))
+            self.sendValue(":STAT:MEAS:ENAB 512")
+            self.sendValue("*SRE 1")
+            self.outputOn()
+        self.sendValue(":INIT")
+
+    def abortBuffer(self):
+        """stops a buffered acquisition that did not finish"""
+        self.sendValue(":ABOR")
+        self.outputOff()
+        self.disarmBuffer()
+
+    def readBuffer(self, points):
+        """switches the output off and reads the full trace buffer of points readings"""
+        self.outputOff()
+        # the ASCII dump of a full buffer takes tens of seconds at 9600 baud
+        oldTimeout = self.ser.timeout
+        self.ser.timeout = oldTimeout + points * 0.05
+        try:
+            answer = self.readValue(":TRAC:DATA?")
+        finally:
+            self.ser.timeout = oldTimeout
+        self.disarmBuffer()
+        return [float(value) for value in answer.strip().split(",")]
+
+    def disarmBuffer(self):
+        """puts the trigger count, buffer and status model back, so read() gets one reading again"""
+        with self.batch():
+            self.sendValue(":TRIG:COUN 1")
+            self.sendValue(":TRAC:FEED:CONT NEV")
+            self.sendValue(":STAT:MEAS:ENAB 0")
+            self.sendValue("*SRE 0")
+            self.sendValue("*CLS")
+
     def setupVoltageMeasurement(self):
         """Function to prepare Keithley vor Voltage measurement.
         cf. page 3-21 in accompanying manual.
         Use this to set Keithley up, followed by calls to read to get the values."""
         #
         self.reset()
-        self.beeperOff()
-        self.setSourceFunc(func="CURR")
-        self.sendValue(":SOUR:CURR:MODE FIXED")
-        self.sendValue(":SENS:FUNC \"VOLT\"")
-        self.sendValue(":SOUR:CURR:RANG MIN")
-        self.sendValue(":SOUR:CURR:LEV 0")
-        self.sendValue(":SENS:VOLT:PROT 25")
-        self.sendValue(":SENS:VOLT:RANG 20")
-        self.sendValue(":FORM:ELEM VOLT")
+        with self.batch():
+            self.beeperOff()
+            self.setSourceFunc(func="CURR")
+            self.sendValue(":SOUR:CURR:MODE FIXED")
+            self.sendValue(":SENS:FUNC \"VOLT\"")
+            self.sendValue(":SOUR:CURR:RANG MIN")
+            self.sendValue(":SOUR:CURR:LEV 0")
+            self.sendValue(":SENS:VOLT:PROT 25")
+            self.sendValue(":SENS:VOLT:RANG 20")
+            self.sendValue(":FORM:ELEM VOLT")
 
         
 
@@ -24,39 +24,57 @@ Keithley.timeout = 25000
 Keithleygate.timeout = 25000
 
 # Turn off concurrent functions and set sensor to current with fixed voltage
-Keithleygate.write(":SENS:FUNC:CONC OFF")
-Keithleygate.write(":SOUR:FUNC VOLT")
-Keithleygate.write(":SENS:FUNC 'CURR:DC' ")
+sweep_setup = [":SENS:FUNC:CONC OFF",
+               ":SOUR:FUNC VOLT",
+               ":SENS:FUNC 'CURR:DC'"]
 
 # Set
-Keithley.write(":SOUR:FUNC VOLT")
-Keithley.write(":SOUR:VOLT:MODE FIXED")
-Keithley.write(":SOUR:VOLT:RANG 20")
-Keithley.write(":SOUR:VOLT:LEV ", fixedv)
-Keithley.write(":SENS:CURR:PROT 1")
+fixed_setup = [":SOUR:FUNC VOLT",
+               ":SOUR:VOLT:MODE FIXED",
+               ":SOUR:VOLT:RANG 20",
+               ":SOUR:VOLT:LEV " + fixedv,
+               ":SENS:CURR:PROT 1"]
 
 # Voltage starting, ending, and spacing values based on input
-Keithleygate.write(":SOUR:VOLT:STAR ", startv)
-Keithleygate.write(":SOUR:VOLT:STOP ", stopv)
-Keithleygate.write(":SOUR:VOLT:STEP ", stepv)
-Keithleygate.write(":SOUR:SWE:RANG AUTO")
+sweep_setup += [":SOUR:VOLT:STAR " + startv,
+                ":SOUR:VOLT:STOP " + stopv,
+                ":SOUR:VOLT:STEP " + stepv,
+                ":SOUR:SWE:RANG AUTO"]
 
 # Set compliance current (in A), sweep direction, and data acquisition
-Keithleygate.write(":SENS:CURR:PROT 1")
-Keithleygate.write(":SOUR:SWE:SPAC LIN")
-Keithleygate.write(":SOUR:SWE:POIN ", str(int(steps)))
-Keithleygate.write(":SOUR:SWE:DIR UP")
-Keithleygate.write(":TRIG:COUN ", str(int(steps)))
-Keithleygate.write(":FORM:ELEM CURR")
+sweep_setup += [":SENS:CURR:PROT 1",
+                ":SOUR:SWE:SPAC LIN",
+                ":SOUR:SWE:POIN " + str(int(steps)),
+                ":SOUR:SWE:DIR UP",
+                ":TRIG:COUN " + str(int(steps)),
+                ":FORM:ELEM CURR"]
 
-# Set sweep mode and turn output on
-Keithleygate.write(":SOUR:VOLT:MODE SWE")
+# Set sweep mode
+sweep_setup.append(":SOUR:VOLT:MODE SWE")
+
+# Send each setup as a single ';'-joined write and check the error queue once per instrument
+for instrument, setup in ((Keithleygate, sweep_setup), (Keithley, fixed_setup)):
+    instrument.write(";".join(setup))
+    errors = instrument.query(":SYST:ERR:ALL?")
+    if not errors.startswith("0,"):
+        print("Setup error on", instrument.resource_name, ":", errors)
+
+# Turn output on
 Keithley.write(":OUTP ON")
 Keithleygate.write(":OUTP ON")
 
-# Initiate sweep, collect ACSII current values, and turn output off
-result = Keithleygate.query(":READ?")
-yvalues = Keithleygate.query_ascii_values(":FETC?")
+# Initiate sweep, collect binary current values (4 byte little endian floats), and turn output off
+# If the binary transfer fails fall back to the ACSII values of the same readings
+Keithleygate.write(":FORM:DATA SREAL")
+Keithleygate.write(":FORM:BORD SWAP")
+try:
+    yvalues = Keithleygate.query_binary_values(":READ?", datatype='f', is_big_endian=False)
+except (visa.VisaIOError, ValueError):
+    Keithleygate.clear()
+    Keithleygate.write(":FORM:DATA ASC")
+    yvalues = Keithleygate.query_ascii_values(":FETC?")
+finally:
+    Keithleygate.write(":FORM:DATA ASC") # leave the 2400 on ASCII for scripts that parse :READ? as text
 Keithleygate.write(":OUTP OFF")
 Keithley.write(":OUTP OFF")
 Keithleygate.write(":SOUR:VOLT 0")
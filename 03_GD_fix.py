@@ -24,39 +24,57 @@ Keithley.timeout = 25000
 Keithleygate.timeout = 25000
 
 # Turn off concurrent functions and set sensor to current with fixed voltage
-Keithley.write(":SENS:FUNC:CONC OFF")
-Keithley.write(":SOUR:FUNC VOLT")
-Keithley.write(":SENS:FUNC 'CURR:DC' ")
+sweep_setup = [":SENS:FUNC:CONC OFF",
+               ":SOUR:FUNC VOLT",
+               ":SENS:FUNC 'CURR:DC'"]
 
 # Set
-Keithleygate.write(":SOUR:FUNC VOLT")
-Keithleygate.write(":SOUR:VOLT:MODE FIXED")
-Keithleygate.write(":SOUR:VOLT:RANG 20")
-Keithleygate.write(":SOUR:VOLT:LEV ", gatev)
-Keithleygate.write(":SENS:CURR:PROT 1")
+fixed_setup = [":SOUR:FUNC VOLT",
+               ":SOUR:VOLT:MODE FIXED",
+               ":SOUR:VOLT:RANG 20",
+               ":SOUR:VOLT:LEV " + gatev,
+               ":SENS:CURR:PROT 1"]
 
 # Voltage starting, ending, and spacing values based on input
-Keithley.write(":SOUR:VOLT:STAR ", startv)
-Keithley.write(":SOUR:VOLT:STOP ", stopv)
-Keithley.write(":SOUR:VOLT:STEP ", stepv)
-Keithley.write(":SOUR:SWE:RANG AUTO")
+sweep_setup += [":SOUR:VOLT:STAR " + startv,
+                ":SOUR:VOLT:STOP " + stopv,
+                ":SOUR:VOLT:STEP " + stepv,
+                ":SOUR:SWE:RANG AUTO"]
 
 # Set compliance current (in A), sweep direction, and data acquisition
-Keithley.write(":SENS:CURR:PROT 1")
-Keithley.write(":SOUR:SWE:SPAC LIN")
-Keithley.write(":SOUR:SWE:POIN ", str(int(steps)))
-Keithley.write(":SOUR:SWE:DIR UP")
-Keithley.write(":TRIG:COUN ", str(int(steps)))
-Keithley.write(":FORM:ELEM CURR")
+sweep_setup += [":SENS:CURR:PROT 1",
+                ":SOUR:SWE:SPAC LIN",
+                ":SOUR:SWE:POIN " + str(int(steps)),
+                ":SOUR:SWE:DIR UP",
+                ":TRIG:COUN " + str(int(steps)),
+                ":FORM:ELEM CURR"]
 
-# Set sweep mode and turn output on
-Keithley.write(":SOUR:VOLT:MODE SWE")
+# Set sweep mode
+sweep_setup.append(":SOUR:VOLT:MODE SWE")
+
+# Send each setup as a single ';'-joined write and check the error queue once per instrument
+for instrument, setup in ((Keithley, sweep_setup), (Keithleygate, fixed_setup)):
+    instrument.write(";".join(setup))
+    errors = instrument.query(":SYST:ERR:ALL?")
+    if not errors.startswith("0,"):
+        print("Setup error on", instrument.resource_name, ":", errors)
+
+# Turn output on
 Keithleygate.write(":OUTP ON")
 Keithley.write(":OUTP ON")
 
-# Initiate sweep, collect ACSII current values, and turn output off
-result = Keithley.query(":READ?")
-yvalues = Keithley.query_ascii_values(":FETC?")
+# Initiate sweep, collect binary current values (4 byte little endian floats), and turn output off
+# If the binary transfer fails fall back to the ACSII values of the same readings
+Keithley.write(":FORM:DATA SREAL")
+Keithley.write(":FORM:BORD SWAP")
+try:
+    yvalues = Keithley.query_binary_values(":READ?", datatype='f', is_big_endian=False)
+except (visa.VisaIOError, ValueError):
+    Keithley.clear()
+    Keithley.write(":FORM:DATA ASC")
+    yvalues = Keithley.query_ascii_values(":FETC?")
+finally:
+    Keithley.write(":FORM:DATA ASC") # leave the 2400 on ASCII for scripts that parse :READ? as text
 Keithley.write(":OUTP OFF")
 Keithleygate.write(":OUTP OFF")
 Keithley.write(":SOUR:VOLT 0")
@@ -4,9 +4,68 @@ VOLTAGE_INDEX = 0;
 CURRENT_INDEX = 1;
 
 ### KEITHLEY COMMANDS - THESE ACTUALLY WORK.
+LIST_MAX_POINTS = 100; # the 2400 source list holds at most 100 points
+LIST_TIMEOUT_MS = 25000; # a full 100 point list at 1 NPLC takes a few seconds
+READING_ELEMENTS = ('VOLT', 'CURR', 'RES', 'TIME', 'STAT'); # order the 2400 sends them in
+
+# Read the reply to a query as a numpy structured array with one field per
+# element, e.g. data['CURR']. The 2400 is switched to binary transfers
+# (:FORM:DATA SREAL or REAL, byte order swapped to little endian) and the
+# IEEE-488.2 block is viewed as the structured array without copying or
+# parsing floats in Python. If the binary transfer fails we go back to
+# ASCII and fetch? the readings that were already taken (query again would
+# run read? a second time, i.e. a second sweep). Either way the 2400 is left
+# on ASCII with its previous elements, so getIData and friends still work.
+def readData(device, query='fetch?', elements=READING_ELEMENTS, data_format='SREAL'):
+    datatype = 'f' if data_format == 'SREAL' else 'd';
+    dtype = np.dtype([(e, '<' + datatype) for e in elements]);
+    old_elements = device.query('format:elements?').strip();
+    device.write('format:elements ' + ','.join(elements));
+    try:
+        device.write('format:data ' + data_format);
+        device.write('format:border swapped');
+        values = device.query_binary_values(query, datatype=datatype, is_big_endian=False, container=np.array);
+        return values.view(dtype);
+    except (visa.VisaIOError, ValueError):
+        device.clear();
+        device.write('format:data ascii');
+        data = device.query('fetch?')
+        values = np.array(list(map(float, data.split(','))));
+        return values.view(np.dtype([(e, '<d') for e in elements]));
+    finally:
+        device.write('format:data ascii');
+        device.write('format:elements ' + old_elements);
+
 # Apply a bunch of voltages, and get back the I/V curve 
 # Gives back a numpy array of voltages and currents [v, c]
+# The voltages are uploaded as a source list (:SOUR:LIST:VOLT) in chunks of
+# LIST_MAX_POINTS and the 2400 steps through each chunk on its own trigger
+# model, so we pay one write and one read per chunk instead of four bus
+# round trips per point.
 def getIVDataVoltage(device, voltages):
+    voltages = np.array(voltages, dtype=float);
+    currents = np.array([]);
+    old_timeout = device.timeout;
+    device.timeout = max(old_timeout or 0, LIST_TIMEOUT_MS);
+    device.write("source:function:voltage");
+    device.write("configure:current"); # CONF resets the trigger model, so it goes first
+    device.write("source:voltage:mode list");
+    try:
+        for start in range(0, len(voltages), LIST_MAX_POINTS):
+            chunk = voltages[start:start + LIST_MAX_POINTS];
+            device.write('source:list:voltage ' + ','.join('%.6E' % v for v in chunk));
+            device.write('trigger:count ' + str(len(chunk)));
+            data = readData(device, 'read?', elements=('VOLT', 'CURR'));
+            currents = np.append(currents, data['CURR']);
+    finally:
+        device.write("source:voltage:mode fixed");
+        device.write('source:clear:immediate')
+        device.timeout = old_timeout;
+    return np.array([voltages,currents])
+
+# Same as getIVDataVoltage, but one getIData call per point. Very slow, only
+# useful to check the list sweep against.
+def getIVDataVoltageStepwise(device, voltages):
     voltages = np.array(voltages);
     currents = np.array([]);
     for v in voltages:
@@ -6,9 +6,15 @@ import numpy as np, datetime
 from bokeh.plotting import figure, ColumnDataSource
 from bokeh.models import TapTool, HoverTool
 import asyncio # For async callback
+from concurrent.futures import ThreadPoolExecutor # For parallel array scans
 from bokeh import palettes # For colormaps
 import matplotlib.pyplot as plt # Import Matplotlib
 import random # For simulation variation
+import traceback, functools
+from contextlib import contextmanager, asynccontextmanager, nullcontext
+from dataclasses import dataclass
+from collections import OrderedDict
+import pyvisa # VISA access to the Keithley 2400
 
 #################################################################
 # Style --------------------------------------------------------
@@ -83,6 +89,38 @@ SELECTED_COLOR = "#1f77b4"
 FULL_SCAN_VMIN = -1.0; FULL_SCAN_VMAX = 1.0; FULL_SCAN_STEP = 0.05; FULL_SCAN_GATE = 0.0
 CONDUCTANCE_VOLTAGE = 0.1; MIN_CONDUCTANCE = 0.1; MAX_CONDUCTANCE = 1.5
 COLOR_PALETTE = palettes.Viridis256
+SCREEN_MIN_CONDUCTANCE = 0.7; SCREEN_MAX_CONDUCTANCE = 1.5 # pass band of the go/no-go screen, read at CONDUCTANCE_VOLTAGE
+SCREEN_PROFILE = 'fast_screen' # measurement profile of the single screening read
+SCREEN_DIGITAL_IO = False # also put each screening bin on the 2400 Digital I/O port (grading mode)
+# Back-ends the full-array scan is split across, one worker thread each. "SIM..." entries
+# run simulate_iv_curve, anything else is the VISA address of a 2400 that reaches its share of
+# the array through its own MUX controller (SCAN_MUX_PORTS).
+SCAN_BACKENDS = ["SIM0", "SIM1", "SIM2", "SIM3"]
+HARDWARE_WORKERS = 4 # threads shared by all sessions for blocking measurement/ISPP work
+SIM_VECTORIZED_SCAN = True # all-SIM scans simulate the whole grid in one NumPy call instead of per device
+SIM_SEED = None # seed for the vectorized simulator; set an int for reproducible virtual arrays
+ARRAY_ID = "array0" # chip/array on the probe station; sessions share stored results per array id
+STORE_MAX_ENTRIES = 20000 # results kept in the shared measurement store, least recently used dropped first
+STORE_TTL = 24 * 3600.0 # s a stored result is kept
+RANGE_HINT_MAX_ENTRIES = 65536 # devices with a remembered resistance
+CACHE_PURGE_INTERVAL = 600 # s between sweeps that drop expired cache entries
+ARCHIVE_PATH = None # append-only HDF5 archive of every measured I-V curve (e.g. "measurement_archive.h5", needs h5py); None = not archived
+ARCHIVE_SIMULATED = False # also archive curves from "SIM..." back-ends
+ARCHIVE_FLUSH_INTERVAL = 2.0 # s between writes of buffered curves by the archive writer thread
+ARCHIVE_FLUSH_CURVES = 1024 # buffered curves that trigger a write before the interval is up
+ARCHIVE_CHUNK_POINTS = 65536 # HDF5 chunk length of the point columns (curve columns use 1/16 of it)
+ARCHIVE_COMPRESSION = "lzf" # HDF5 filter of all columns ("gzip" packs tighter, None stores raw)
+MUX_PORT = None # serial port of the Arduino Mega MUX controller (e.g. "/dev/ttyACM0"); None = no switching
+SCAN_MUX_PORTS = {} # 2400 VISA address -> serial port of the MUX controller in front of it; back-ends not listed use MUX_PORT
+MUX_BAUDRATE = 115200
+SRQ_POLL_INTERVAL = 0.05 # s between status byte polls when no VISA service-request events are available
+TRIGGER_LINK_SCAN = False # full-array scan paced by the 2400 Trigger Link and the MUX route table (needs a MUX controller)
+TLINK_SMU_INPUT_LINE = 1 # 2400 Trigger Link line driven by the MUX "settled" output
+TLINK_SMU_OUTPUT_LINE = 2 # 2400 Trigger Link line that steps the MUX route table
+KEITHLEY_ADDRESS = "GPIB0::24::INSTR"
+VISA_IDLE_TIMEOUT = 300.0 # s an unused session stays open in the pool
+VISA_HEALTH_CHECK_INTERVAL = 30.0 # s between *OPC? checks of a pooled session
+SETTINGS_CACHE_TTL = 5.0 # s a settings snapshot is served from cache
 
 # --- Global Simulation State ---
 device_states = {} # Use dict for standalone simulation state
@@ -117,6 +155,13 @@ def cleanup_on_exit():
     """Function called when the Python process exits."""
     print(f"\n--- Server Shutting Down ({datetime.datetime.now()}) ---")
     print("Performing cleanup tasks...")
+    pool = pn.state.cache.get('instrument_pool')
+    if pool is not None: pool.close_all()
+    for router in pn.state.cache.get('mux_routers', {}).values(): router.close()
+    executor = pn.state.cache.get('hardware_executor')
+    if executor is not None: executor.shutdown(wait=False, cancel_futures=True)
+    archive = pn.state.cache.get('measurement_archive')
+    if archive is not None: archive.close() # writes what is still buffered
     print("Cleanup complete. Server exiting.")
 
 # Register the functions
@@ -124,20 +169,614 @@ pn.state.onload(initialize_server_resources)
 atexit.register(cleanup_on_exit)
 
 
+#################################################################
+# --- Bounded Caches / Session State ---
+#################################################################
+class BoundedCache:
+    """Thread-safe mapping for state kept across sessions: at most max_entries entries (the least
+    recently used go first) and, with ttl set, entries older than ttl seconds are dropped."""
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries; self.ttl = ttl
+        self._lock = threading.Lock(); self._data = OrderedDict() # key -> (time stored, value)
+
+    def _expired(self, stamp, now): return self.ttl is not None and now - stamp > self.ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None: return default
+            if self._expired(entry[0], time.time()): del self._data[key]; return default
+            self._data.move_to_end(key); return entry[1]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time(), value); self._data.move_to_end(key)
+            while len(self._data) > self.max_entries: self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock: entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def items(self):
+        """Live (key, value) pairs; does not count as a use."""
+        now = time.time()
+        with self._lock: return [(key, value) for key, (stamp, value) in self._data.items() if not self._expired(stamp, now)]
+
+    def purge(self):
+        """Drops expired entries and returns how many there were."""
+        if self.ttl is None: return 0
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (stamp, _) in self._data.items() if now - stamp > self.ttl]
+            for key in expired: del self._data[key]
+        return len(expired)
+
+    def __len__(self):
+        with self._lock: return len(self._data)
+
+# pn.state.cache keys holding one browser session's state, followed by the session id
+SESSION_STATE_PREFIXES = ('selector_page_components_', 'selector_last_sel_')
+
+def release_session_state(session_id):
+    """Drops everything kept in pn.state.cache for one browser session (its figures, sources and widgets)."""
+    released = [prefix for prefix in SESSION_STATE_PREFIXES if pn.state.cache.pop(f"{prefix}{session_id}", None) is not None]
+    print(f"Session {session_id} destroyed: released {len(released)} cache entries")
+
+def purge_expired_caches():
+    """Periodic task: drops expired entries from the caches shared across sessions and closes
+    VISA sessions that have been idle for VISA_IDLE_TIMEOUT."""
+    purged = get_measurement_store().purge()
+    if purged: print(f"Cache purge: dropped {purged} expired measurement store entries")
+    pool = pn.state.cache.get('instrument_pool')
+    if pool is not None: pool.close_idle() # otherwise only a new lease would close them
+
+def memory_report():
+    """What the server process keeps in memory, by cache, for the Memory page."""
+    store = get_measurement_store(); pool = pn.state.cache.get('instrument_pool')
+    return {'generated': datetime.datetime.now().isoformat(timespec='seconds'),
+            'pn_state_cache_keys': len(pn.state.cache),
+            'sessions_with_state': sum(1 for key in list(pn.state.cache) if key.startswith(SESSION_STATE_PREFIXES[0])),
+            'store_entries': len(store), 'store_entries_max': STORE_MAX_ENTRIES, 'store_points': store.point_count(),
+            'store_subscribers': store.subscriber_count(),
+            'range_hints': len(get_range_hints()), 'range_hints_max': RANGE_HINT_MAX_ENTRIES,
+            'open_visa_sessions': pool.open_count() if pool is not None else 0,
+            'archive_buffered_curves': archive.pending_count() if (archive := pn.state.cache.get('measurement_archive')) is not None else 0}
+
+pn.state.schedule_task('purge_expired_caches', purge_expired_caches, period=f'{min(CACHE_PURGE_INTERVAL, VISA_IDLE_TIMEOUT):.0f}s', threaded=True) # scheduled once per process; closing sessions may block
+
+
+#################################################################
+# --- Instrument Session Pool ---
+#################################################################
+class InstrumentPool:
+    """Process-wide pool of open VISA sessions, one per resource address.
+
+    Sessions are opened on first use and then kept open across pages and browser
+    sessions. lease() hands out a session exclusively, so two callbacks never talk
+    to the same instrument at once. A session that has been idle for longer than
+    the health check interval is checked with *OPC? before it is handed out, and
+    sessions unused for idle_timeout seconds are closed.
+    """
+    def __init__(self, idle_timeout=VISA_IDLE_TIMEOUT, health_check_interval=VISA_HEALTH_CHECK_INTERVAL):
+        self.idle_timeout = idle_timeout; self.health_check_interval = health_check_interval
+        self._lock = threading.Lock(); self._rm = None; self._entries = {} # address -> entry dict
+
+    def resource_manager(self):
+        with self._lock:
+            if self._rm is None: self._rm = pyvisa.ResourceManager(); print("VISA Resource Manager initialized.")
+            return self._rm
+
+    def _entry(self, address):
+        with self._lock:
+            if address not in self._entries: self._entries[address] = {'resource': None, 'lease': threading.Lock(), 'last_used': 0.0}
+            return self._entries[address]
+
+    def _open(self, address, entry, timeout_ms):
+        print(f"VISA Pool: Opening session to {address}")
+        instrument = self.resource_manager().open_resource(address)
+        instrument.timeout = timeout_ms; instrument.write_termination = '\n'; instrument.read_termination = '\n'
+        instrument.write("*CLS"); entry['resource'] = instrument; entry['idn'] = instrument.query("*IDN?").strip()
+        invalidate_cached_settings(address) # a new session may follow a power cycle or front-panel changes
+        return instrument
+
+    def _discard(self, address, entry):
+        instrument = entry['resource']; entry['resource'] = None
+        if instrument is not None:
+            print(f"VISA Pool: Closing session to {address}")
+            try: instrument.close()
+            except Exception as e: print(f"VISA Pool: Error closing {address}: {e}")
+
+    def _checkout(self, address, entry, timeout_ms):
+        """Returns the session for a held lease: health-checked if it has been idle, reopened if needed."""
+        instrument = entry['resource']
+        if instrument is not None and time.time() - entry['last_used'] > self.health_check_interval:
+            try: instrument.query("*OPC?")
+            except Exception as e: print(f"VISA Pool: Health check failed for {address}: {e}"); self._discard(address, entry); instrument = None
+        if instrument is None: instrument = self._open(address, entry, timeout_ms)
+        instrument.timeout = timeout_ms
+        return instrument
+
+    @contextmanager
+    def lease(self, address, timeout_ms=5000, wait_s=30.0):
+        """Exclusive access to the open session for address. A session that raises
+        inside the with block is closed so the next lease reopens it."""
+        self.close_idle(exclude=address)
+        entry = self._entry(address)
+        if not entry['lease'].acquire(timeout=wait_s): raise TimeoutError(f"Instrument {address} is busy.")
+        try:
+            instrument = self._checkout(address, entry, timeout_ms)
+            try: yield instrument
+            except Exception: self._discard(address, entry); raise
+        finally:
+            entry['last_used'] = time.time(); entry['lease'].release()
+
+    @asynccontextmanager
+    async def lease_async(self, address, timeout_ms=5000, wait_s=30.0, poll_interval=SRQ_POLL_INTERVAL):
+        """lease() for coroutines: waiting for a busy instrument sleeps with asyncio, and
+        closing idle sessions and the checkout (open, *IDN?, *OPC? health check) run on the
+        hardware executor, so none of it blocks the event loop that serves every session."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(get_hardware_executor(), functools.partial(self.close_idle, exclude=address))
+        entry = self._entry(address); deadline = time.time() + wait_s
+        while not entry['lease'].acquire(blocking=False):
+            if time.time() > deadline: raise TimeoutError(f"Instrument {address} is busy.")
+            await asyncio.sleep(poll_interval)
+        try:
+            instrument = await loop.run_in_executor(get_hardware_executor(), self._checkout, address, entry, timeout_ms)
+            try: yield instrument
+            except Exception: self._discard(address, entry); raise
+        finally:
+            entry['last_used'] = time.time(); entry['lease'].release()
+
+    def close_idle(self, exclude=None):
+        now = time.time()
+        with self._lock: entries = list(self._entries.items())
+        for address, entry in entries:
+            if address == exclude or entry['resource'] is None or now - entry['last_used'] < self.idle_timeout: continue
+            if entry['lease'].acquire(blocking=False):
+                try: self._discard(address, entry)
+                finally: entry['lease'].release()
+
+    def close_all(self):
+        with self._lock: entries = list(self._entries.items())
+        for address, entry in entries: self._discard(address, entry)
+
+    def idn(self, address):
+        """*IDN? reply of address as read when its session was last opened ('' if never opened)."""
+        with self._lock: entry = self._entries.get(address)
+        return entry.get('idn', '') if entry is not None else ''
+
+    def open_count(self):
+        with self._lock: return sum(1 for entry in self._entries.values() if entry['resource'] is not None)
+
+def get_instrument_pool():
+    """Returns the process-wide InstrumentPool, shared through pn.state.cache."""
+    if 'instrument_pool' not in pn.state.cache: pn.state.cache['instrument_pool'] = InstrumentPool()
+    return pn.state.cache['instrument_pool']
+
+
+#################################################################
+# --- Instrument Settings Snapshot ---
+#################################################################
+# Order of the fields in the compound settings query (and in its ';'-separated reply)
+SETTINGS_QUERIES = (('idn', '*IDN?'), ('source_func', ':SOUR:FUNC?'), ('sense_mode', ':SYST:RSEN?'),
+                    ('compliance_curr', ':SENS:CURR:PROT?'), ('compliance_volt', ':SENS:VOLT:PROT?'),
+                    ('nplc_curr', ':SENS:CURR:NPLC?'), ('nplc_volt', ':SENS:VOLT:NPLC?'),
+                    ('output_state', ':OUTP:STAT?'), ('terminals', ':ROUT:TERM?'))
+SETTINGS_SNAPSHOT_QUERY = ";".join(cmd for _, cmd in SETTINGS_QUERIES)
+
+@dataclass
+class InstrumentSettings:
+    """Settings of the Keithley 2400 as read by one SETTINGS_SNAPSHOT_QUERY."""
+    idn: str
+    source_func: str
+    four_wire: bool
+    compliance_curr: float
+    compliance_volt: float
+    nplc_curr: float
+    nplc_volt: float
+    output_on: bool
+    terminals: str
+
+    @classmethod
+    def from_reply(cls, reply):
+        fields = [f.strip() for f in reply.strip().split(';')]
+        if len(fields) != len(SETTINGS_QUERIES): raise ValueError(f"Expected {len(SETTINGS_QUERIES)} fields in settings reply, got {len(fields)}: {reply!r}")
+        r = dict(zip((key for key, _ in SETTINGS_QUERIES), fields))
+        return cls(idn=r['idn'], source_func=r['source_func'], four_wire=int(r['sense_mode']) == 1,
+                   compliance_curr=float(r['compliance_curr']), compliance_volt=float(r['compliance_volt']),
+                   nplc_curr=float(r['nplc_curr']), nplc_volt=float(r['nplc_volt']),
+                   output_on=int(r['output_state']) == 1, terminals=r['terminals'])
+
+def get_cached_settings(address, max_age=SETTINGS_CACHE_TTL):
+    """Returns the cached InstrumentSettings for address if younger than max_age, else None."""
+    entry = pn.state.cache.get(f'settings_snapshot_{address}')
+    if entry is not None and time.time() - entry[0] < max_age: return entry[1]
+    return None
+
+def cache_settings(address, settings): pn.state.cache[f'settings_snapshot_{address}'] = (time.time(), settings)
+
+def invalidate_cached_settings(address):
+    """Forgets what is known about the instrument's state: the settings snapshot and the active measurement profile."""
+    pn.state.cache.pop(f'settings_snapshot_{address}', None); pn.state.cache.pop(f'measurement_profile_{address}', None)
+
+
+#################################################################
+# --- Measurement Profiles ---
+#################################################################
+@dataclass(frozen=True)
+class MeasurementProfile:
+    """Speed/noise settings for current readings on the 2400. current_range None means autorange,
+    average_count > 1 turns on the repeat filter. noise_floor is the nominal rms noise (A) of one
+    reading taken with the profile, used by select_measurement_profile."""
+    name: str
+    nplc: float
+    autozero: str = 'ON' # ON, OFF or ONCE
+    autozero_cache: bool = False # keep cached autozero references (:SYST:AZER:CACH) for the NPLC in use
+    current_range: float = None
+    average_count: int = 1
+    noise_floor: float = 1e-10
+
+    def commands(self):
+        """Setting name -> command string; apply_measurement_profile sends only those that differ."""
+        return {'nplc': f":SENS:CURR:NPLC {self.nplc}",
+                'autozero': f":SYST:AZER:STAT {self.autozero}",
+                'autozero_cache': f":SYST:AZER:CACH:STAT {'ON' if self.autozero_cache else 'OFF'}",
+                'range': ":SENS:CURR:RANG:AUTO ON" if self.current_range is None else f":SENS:CURR:RANG:AUTO OFF;:SENS:CURR:RANG {self.current_range:.4e}",
+                'filter': ":SENS:AVER:STAT OFF" if self.average_count <= 1 else f":SENS:AVER:TCON REP;:SENS:AVER:COUN {self.average_count};:SENS:AVER:STAT ON"}
+
+    @property
+    def reading_time(self):
+        """Relative time per reading, for picking the fastest profile."""
+        return self.nplc * max(1, self.average_count) * (2 if self.autozero == 'ON' else 1)
+
+MEASUREMENT_PROFILES = {p.name: p for p in (
+    MeasurementProfile('fast_screen', nplc=0.01, autozero='OFF', autozero_cache=True, noise_floor=1e-8),
+    MeasurementProfile('ispp_verify', nplc=0.1, autozero='ONCE', noise_floor=1e-9),
+    MeasurementProfile('default', nplc=1, autozero='ON', noise_floor=1e-10),
+    MeasurementProfile('precise_read', nplc=10, autozero='ON', average_count=10, noise_floor=1e-12),
+)}
+
+def select_measurement_profile(noise_floor=None):
+    """Fastest profile whose noise floor is at or below noise_floor (A); the quietest one if none is.
+    noise_floor None gives the 'default' profile."""
+    if noise_floor is None: return MEASUREMENT_PROFILES['default']
+    quiet_enough = [p for p in MEASUREMENT_PROFILES.values() if p.noise_floor <= noise_floor]
+    if not quiet_enough: return min(MEASUREMENT_PROFILES.values(), key=lambda p: p.noise_floor)
+    return min(quiet_enough, key=lambda p: p.reading_time)
+
+def apply_measurement_profile(instrument, address, profile):
+    """Switches the leased instrument to profile (a MeasurementProfile or its name), writing only the
+    settings that differ from the profile last applied to address. Returns the commands sent."""
+    if isinstance(profile, str): profile = MEASUREMENT_PROFILES[profile]
+    key = f'measurement_profile_{address}'; active = pn.state.cache.get(key, {}); wanted = profile.commands()
+    changed = [cmd for setting, cmd in wanted.items() if active.get(setting) != cmd]
+    if changed: instrument.write(";".join(changed)); print(f"Profile '{profile.name}' on {address}: {len(changed)} setting(s) changed")
+    pn.state.cache[key] = wanted
+    return changed
+
+
+#################################################################
+# --- Current Range Hints ---
+#################################################################
+RANGE_HEADROOM = 2.0 # a fixed range must hold expected current * RANGE_HEADROOM
+MAX_CURRENT_RANGE = 1.05 # top 2400 current range (A)
+OVERFLOW_READING = 9.9e37 # what the 2400 returns for a reading beyond a fixed range
+STATUS_COMPLIANCE = 1 << 3; STATUS_RANGE_COMPLIANCE = 1 << 16 # bits of the STAT reading element
+
+def get_range_hints():
+    """Process-wide (row, col) -> last measured resistance, used to pick fixed current ranges."""
+    if 'range_hints' not in pn.state.cache: pn.state.cache['range_hints'] = BoundedCache(RANGE_HINT_MAX_ENTRIES)
+    return pn.state.cache['range_hints']
+
+def remember_resistance(row, col, resistance):
+    if resistance is not None and np.isfinite(resistance) and resistance > 0: get_range_hints()[(row, col)] = resistance
+    else: get_range_hints().pop((row, col), None)
+
+def hinted_current_range(row, col, voltage, headroom=RANGE_HEADROOM):
+    """Fixed current range (A) for reading (row, col) at voltage, or None (autorange) without a hint."""
+    resistance = get_range_hints().get((row, col))
+    if resistance is None or voltage == 0: return None
+    return min(abs(voltage) / resistance * headroom, MAX_CURRENT_RANGE)
+
+def set_current_range(instrument, address, current_range):
+    """Locks the current range (the 2400 picks the lowest range holding current_range) or, for None,
+    autoranges. Kept in step with the active measurement profile so its diffing stays right."""
+    command = ":SENS:CURR:RANG:AUTO ON" if current_range is None else f":SENS:CURR:RANG:AUTO OFF;:SENS:CURR:RANG {current_range:.4e}"
+    active = pn.state.cache.get(f'measurement_profile_{address}')
+    if active is not None and active.get('range') == command: return
+    instrument.write(command)
+    if active is not None: active['range'] = command
+
+def readings_out_of_range(currents, statuses):
+    """True if any reading overflowed or any STAT element carries a compliance or range compliance flag.
+    A range compliance reading is clamped to the range, not 9.9e37, so only STAT gives it away."""
+    flags = np.asarray(statuses).astype(np.int64) & (STATUS_COMPLIANCE | STATUS_RANGE_COMPLIANCE)
+    return bool(np.any(np.abs(currents) >= OVERFLOW_READING) or np.any(flags))
+
+def read_current_ranged(instrument, address, row, col, voltage):
+    """One :READ? of (row, col) at the sourced voltage on the range its hint calls for. An overflow or
+    compliance flag on a fixed range repeats the read on autorange. Updates the hint, returns the current."""
+    hinted = hinted_current_range(row, col, voltage)
+    for current_range in ([hinted, None] if hinted is not None else [None]):
+        set_current_range(instrument, address, current_range)
+        current, status = (float(v) for v in instrument.query(":FORM:ELEM CURR,STAT;:READ?").split(","))
+        if not readings_out_of_range(current, status): break
+        if current_range is not None: print(f"Range {current_range:.2e} A too low for R{row}C{col}, retrying on autorange")
+    remember_resistance(row, col, voltage / current if current else None)
+    return current
+
+
+#################################################################
+# --- Shared Measurement Store ---
+#################################################################
+def iv_params(vmin, vmax, step, gate_v, compliance):
+    """Hashable measurement-parameter key for stored I-V curves and conductances."""
+    return tuple(round(float(x), 12) for x in (vmin, vmax, step, gate_v, compliance))
+
+class MeasurementStore:
+    """Process-wide measurement results, shared by every browser session.
+
+    Results are keyed by (kind, array id, params, row, col), kind being 'iv', 'conductance' or
+    'ispp' and params the measurement parameters (iv_params, or (target, tolerance) for ISPP), and
+    held in a BoundedCache (STORE_MAX_ENTRIES, STORE_TTL). Sessions subscribe with their Bokeh
+    document; results stored by one session are handed to every other subscribed session on its next tick.
+    """
+    def __init__(self, max_entries=STORE_MAX_ENTRIES, ttl=STORE_TTL):
+        self._lock = threading.Lock(); self._results = BoundedCache(max_entries, ttl); self._subscribers = {}; self._next_token = 0
+
+    def get(self, kind, row, col, params, array_id=ARRAY_ID):
+        return self._results.get((kind, array_id, params, row, col))
+
+    def results(self, kind, params, array_id=ARRAY_ID):
+        """{(row, col): value} of everything stored for kind and params."""
+        group = (kind, array_id, params)
+        return {key[3:]: value for key, value in self._results.items() if key[:3] == group}
+
+    def purge(self): return self._results.purge()
+
+    def __len__(self): return len(self._results)
+
+    def point_count(self):
+        """Number of I-V points held, the bulk of the store's memory."""
+        return sum(len(value['voltage']) for key, value in self._results.items() if key[0] == 'iv')
+
+    def subscriber_count(self):
+        with self._lock: return len(self._subscribers)
+
+    def put(self, kind, row, col, params, value, array_id=ARRAY_ID, source=None):
+        self.put_many(kind, params, {(row, col): value}, array_id, source)
+
+    def put_many(self, kind, params, items, array_id=ARRAY_ID, source=None):
+        """Stores {(row, col): value} and pushes it to the subscribed sessions other than the source document."""
+        for (row, col), value in items.items(): self._results[(kind, array_id, params, row, col)] = value
+        with self._lock: subscribers = list(self._subscribers.values())
+        for doc, callback in subscribers:
+            if doc is source: continue
+            try: doc.add_next_tick_callback(functools.partial(callback, kind, array_id, params, items))
+            except Exception as e: print(f"Measurement store: could not notify a session: {e}")
+
+    def subscribe(self, doc, callback):
+        """callback(kind, array_id, params, items) runs on doc's next tick for results stored by other
+        sessions. The subscription ends with the session."""
+        with self._lock: token = self._next_token; self._next_token += 1; self._subscribers[token] = (doc, callback)
+        doc.on_session_destroyed(lambda session_context: self.unsubscribe(token))
+        return token
+
+    def unsubscribe(self, token):
+        with self._lock: self._subscribers.pop(token, None)
+
+def get_measurement_store():
+    """Returns the process-wide MeasurementStore, shared through pn.state.cache."""
+    if 'measurement_store' not in pn.state.cache: pn.state.cache['measurement_store'] = MeasurementStore()
+    return pn.state.cache['measurement_store']
+
+
+#################################################################
+# --- Measurement Archive ---
+#################################################################
+# Per-curve columns of the archive: name -> (dtype, shape of one row); 'str' is a variable-length string
+ARCHIVE_CURVE_COLUMNS = {'start': ('i8', ()), 'length': ('i4', ()), 'timestamp': ('f8', ()),
+                         'array_id': ('str', ()), 'row': ('i4', ()), 'col': ('i4', ()),
+                         'backend': ('str', ()), 'idn': ('str', ()),
+                         'compliance': ('f8', ()), 'nplc': ('f8', ()), 'gate_v': ('f8', ()), 'route': ('u2', (4,))}
+
+class MeasurementArchive:
+    """Append-only HDF5 archive of I-V curves, one column per dataset.
+
+    /points/voltage and /points/current hold the points of all curves back to back; each
+    /curves/<column> holds one value per curve: where its points start and how many there are,
+    plus timestamp, array id, row, col, back-end, instrument IDN, compliance, NPLC, gate
+    voltage and MUX route words. All datasets are chunked, compressed and only ever grow.
+    append() only buffers the curve; a writer thread writes the buffer every flush_interval
+    seconds, or as soon as flush_curves curves are waiting. An in-memory index maps
+    (array id, row, col) to curve numbers; it is built on open from the array_id, row and col
+    columns, read block by block, and kept up to date by each write. Reads look the curves up
+    there, fetch only those rows of the curve columns and then only the point slices they
+    cover, so only the touched chunks are read from disk and decompressed.
+    """
+    def __init__(self, path, flush_interval=ARCHIVE_FLUSH_INTERVAL, flush_curves=ARCHIVE_FLUSH_CURVES,
+                 chunk_points=ARCHIVE_CHUNK_POINTS, compression=ARCHIVE_COMPRESSION):
+        import h5py # only needed when an archive is configured
+        self.path = path; self.flush_interval = flush_interval; self.flush_curves = flush_curves
+        self._pending = []; self._pending_lock = threading.Lock(); self._file_lock = threading.Lock()
+        self._wake = threading.Event(); self._closing = False
+        self._file = h5py.File(path, 'a')
+        for name in ('voltage', 'current'):
+            if f'points/{name}' not in self._file:
+                self._file.create_dataset(f'points/{name}', shape=(0,), maxshape=(None,), dtype='f4', chunks=(chunk_points,), compression=compression)
+        for name, (dtype, shape) in ARCHIVE_CURVE_COLUMNS.items():
+            if f'curves/{name}' not in self._file:
+                self._file.create_dataset(f'curves/{name}', shape=(0,) + shape, maxshape=(None,) + shape, dtype=h5py.string_dtype() if dtype == 'str' else dtype,
+                                          chunks=(max(1, chunk_points // 16),) + shape, compression=compression)
+        self._index = {} # (array_id, row, col) -> ascending curve numbers
+        self._index_curves(0, self._file['curves/start'].shape[0], chunk_points)
+        self._writer = threading.Thread(target=self._write_loop, name="archive-writer", daemon=True); self._writer.start()
+
+    def _index_curves(self, first, last, block):
+        """Adds curves first..last-1 to the index, reading only the array_id, row and col columns, block rows at a time."""
+        array_ids = self._file['curves/array_id'].asstr(); rows = self._file['curves/row']; cols = self._file['curves/col']
+        for start in range(first, last, block):
+            stop = min(start + block, last)
+            for k, key in enumerate(zip(array_ids[start:stop], rows[start:stop].tolist(), cols[start:stop].tolist())):
+                self._index.setdefault(key, []).append(start + k)
+
+    def append(self, row, col, voltage, current, array_id=ARRAY_ID, **metadata):
+        """Buffers one curve. metadata: any ARCHIVE_CURVE_COLUMNS entry except start/length
+        (timestamp defaults to now, missing numbers to NaN, strings to '')."""
+        record = {'timestamp': time.time(), 'array_id': array_id, 'row': row, 'col': col, 'backend': '', 'idn': '',
+                  'compliance': np.nan, 'nplc': np.nan, 'gate_v': np.nan, 'route': (0, 0, 0, 0)}
+        record.update(metadata)
+        record['voltage'] = np.asarray(voltage, dtype=np.float32); record['current'] = np.asarray(current, dtype=np.float32)
+        with self._pending_lock: self._pending.append(record); waiting = len(self._pending)
+        if waiting >= self.flush_curves: self._wake.set()
+
+    def pending_count(self):
+        with self._pending_lock: return len(self._pending)
+
+    def _write_loop(self):
+        while not self._closing:
+            self._wake.wait(self.flush_interval); self._wake.clear()
+            try: self.flush()
+            except Exception as e: print(f"Archive: error writing {self.path}: {e}")
+
+    def flush(self):
+        """Writes every buffered curve: one resize and one slice write per column."""
+        with self._file_lock: # held while taking the buffer too, so concurrent flushes write in append order
+            with self._pending_lock: records, self._pending = self._pending, []
+            if not records: return 0
+            lengths = np.array([len(r['voltage']) for r in records], dtype=np.int64)
+            points_v = self._file['points/voltage']; points_i = self._file['points/current']; first_point = points_v.shape[0]
+            columns = {'start': first_point + np.concatenate(([0], np.cumsum(lengths)[:-1])), 'length': lengths}
+            columns.update({name: [r[name] for r in records] for name in ARCHIVE_CURVE_COLUMNS if name not in columns})
+            total = first_point + int(lengths.sum())
+            points_v.resize((total,)); points_v[first_point:total] = np.concatenate([r['voltage'] for r in records])
+            points_i.resize((total,)); points_i[first_point:total] = np.concatenate([r['current'] for r in records])
+            first_curve = self._file['curves/start'].shape[0]
+            for name, values in columns.items():
+                dataset = self._file[f'curves/{name}']
+                dataset.resize((first_curve + len(records),) + dataset.shape[1:]); dataset[first_curve:] = values
+            self._file.flush()
+            for k, r in enumerate(records): self._index.setdefault((r['array_id'], int(r['row']), int(r['col'])), []).append(first_curve + k)
+        return len(records)
+
+    def _curve_rows(self, indices):
+        """Curve columns {name: ndarray} (strings decoded) of the ascending curve numbers indices.
+        Close-together curves are read as one slice, scattered ones by point selection."""
+        indices = np.asarray(indices, dtype=np.int64)
+        first, last = (int(indices[0]), int(indices[-1]) + 1) if len(indices) else (0, 0)
+        dense = last - first <= 4 * len(indices); table = {}
+        for name in ARCHIVE_CURVE_COLUMNS:
+            dataset = self._file[f'curves/{name}']
+            if dataset.dtype.kind == 'O': dataset = dataset.asstr()
+            table[name] = dataset[first:last][indices - first] if dense else dataset[indices]
+        return table
+
+    def curves(self, array_id=None):
+        """Curve columns {name: ndarray} (strings decoded), of every curve or only those of array_id."""
+        self.flush()
+        with self._file_lock:
+            if array_id is None: indices = np.arange(self._file['curves/start'].shape[0])
+            else: indices = np.sort(np.array([i for key, numbers in self._index.items() if key[0] == array_id for i in numbers], dtype=np.int64))
+            return self._curve_rows(indices)
+
+    def _read_points(self, starts, lengths):
+        with self._file_lock:
+            points_v = self._file['points/voltage']; points_i = self._file['points/current']
+            return [(points_v[s:s + n], points_i[s:s + n]) for s, n in zip(starts, lengths)]
+
+    def read_device(self, row, col, array_id=ARRAY_ID):
+        """Every archived curve of one device, oldest first: [{'voltage', 'current', **curve columns}, ...]."""
+        self.flush()
+        with self._file_lock: table = self._curve_rows(self._index.get((array_id, row, col), []))
+        points = self._read_points(table['start'], table['length'])
+        return [dict({name: values[k] for name, values in table.items()}, voltage=v, current=i) for k, (v, i) in enumerate(points)]
+
+    def read_array(self, array_id=ARRAY_ID):
+        """All curves of one array (wafer) as (curve columns, voltage, current): voltage and current
+        hold the points of the span the curves occupy, with the 'start' column made relative to it."""
+        table = self.curves(array_id)
+        if len(table['start']) == 0: return table, np.empty(0, np.float32), np.empty(0, np.float32)
+        first = int(table['start'].min()); last = int((table['start'] + table['length']).max())
+        (voltage, current), = self._read_points([first], [last - first])
+        table['start'] = table['start'] - first
+        return table, voltage, current
+
+    def close(self):
+        self._closing = True; self._wake.set(); self._writer.join(timeout=10)
+        self.flush()
+        with self._file_lock: self._file.close()
+
+def get_measurement_archive():
+    """Returns the process-wide MeasurementArchive for ARCHIVE_PATH (None when archiving is off)."""
+    if ARCHIVE_PATH is None: return None
+    if 'measurement_archive' not in pn.state.cache: pn.state.cache['measurement_archive'] = MeasurementArchive(ARCHIVE_PATH)
+    return pn.state.cache['measurement_archive']
+
+def active_nplc(address):
+    """NPLC of the current readings on address: from the measurement profile last applied, else the
+    last settings snapshot, else NaN."""
+    command = pn.state.cache.get(f'measurement_profile_{address}', {}).get('nplc')
+    if command is not None: return float(command.split()[-1])
+    entry = pn.state.cache.get(f'settings_snapshot_{address}')
+    return entry[1].nplc_curr if entry is not None else np.nan
+
+def archive_iv_curve(backend, row, col, iv_data, gate_v, compliance, array_id=ARRAY_ID):
+    """Buffers one measured I-V curve in the archive with the instrument and MUX state it was taken with."""
+    archive = get_measurement_archive()
+    if archive is None or (backend.startswith("SIM") and not ARCHIVE_SIMULATED): return
+    if backend.startswith("SIM"): idn = "SIM"; nplc = np.nan; route = (0, 0, 0, 0)
+    else:
+        idn = get_instrument_pool().idn(backend); nplc = active_nplc(backend)
+        router = get_mux_router(backend); route = tuple(router.route_words(row, col)) if router is not None else (0, 0, 0, 0)
+    archive.append(row, col, iv_data['voltage'], iv_data['current'], array_id, backend=backend, idn=idn,
+                   compliance=compliance, nplc=nplc, gate_v=gate_v, route=route)
+
+
+def get_hardware_executor():
+    """Process-wide thread pool for blocking hardware routines (ISPP, single-device sweeps),
+    so they never run on the Bokeh event loop that serves every session."""
+    if 'hardware_executor' not in pn.state.cache: pn.state.cache['hardware_executor'] = ThreadPoolExecutor(max_workers=HARDWARE_WORKERS, thread_name_prefix="hardware")
+    return pn.state.cache['hardware_executor']
+
+
 # --- Simulation Function ---
 def simulate_iv_curve(row, col, vmin, vmax, step, gate_v):
     """Generates I-V curve data using measurement parameters."""
     print(f"Simulating R{row}C{col}: Vmin={vmin}, Vmax={vmax}, Step={step}, Gate={gate_v}")
+    voltage, current = simulate_iv_array([row], [col], vmin, vmax, step, gate_v)
+    return dict(voltage=voltage.tolist(), current=current[0].tolist())
+
+def simulate_iv_array(rows, cols, vmin, vmax, step, gate_v, seed=None):
+    """Vectorized simulate_iv_curve: returns (voltage, current) where current is a
+    (devices, points) matrix, one row per (rows[i], cols[i]). seed makes the noise reproducible."""
     if step == 0: step = 0.01
     num_points = int(np.floor((vmax - vmin) / step)) + 1
     voltage = np.linspace(vmin, vmin + (num_points - 1) * step, num_points)
     voltage = np.clip(voltage, vmin, vmax)
-    resistance = 1 + (row + col * GRID_SIZE) / (GRID_SIZE*GRID_SIZE*1.5)
+    rows = np.asarray(rows)[:, None]; cols = np.asarray(cols)[:, None]
+    resistance = 1 + (rows + cols * GRID_SIZE) / (GRID_SIZE*GRID_SIZE*1.5)
     gate_factor = 1 + gate_v * 0.1
-    current = (voltage / (resistance * gate_factor)) + np.random.normal(0, 0.05, size=voltage.shape)
-    threshold = 0.5 + (row % 4) * 0.1
-    current[np.abs(voltage) > threshold] *= (1.1 + gate_v * 0.05)
-    return dict(voltage=voltage.tolist(), current=current.tolist())
+    rng = np.random.default_rng(seed)
+    current = (voltage / (resistance * gate_factor)) + rng.normal(0, 0.05, size=(rows.shape[0], num_points))
+    threshold = 0.5 + (rows % 4) * 0.1
+    current = np.where(np.abs(voltage) > threshold, current * (1.1 + gate_v * 0.05), current)
+    return voltage, current
+
+def conductance_at_read_voltage(voltage, currents):
+    """Conductance of each row of a (devices, points) current matrix at CONDUCTANCE_VOLTAGE,
+    interpolated like np.interp, in one pass."""
+    voltage = np.asarray(voltage, dtype=float); currents = np.atleast_2d(np.asarray(currents, dtype=float))
+    if abs(CONDUCTANCE_VOLTAGE) < 1e-9: return np.zeros(currents.shape[0])
+    if voltage.size == 1: return currents[:, 0] / CONDUCTANCE_VOLTAGE
+    i = np.clip(np.searchsorted(voltage, CONDUCTANCE_VOLTAGE), 1, voltage.size - 1)
+    w = np.clip((CONDUCTANCE_VOLTAGE - voltage[i - 1]) / (voltage[i] - voltage[i - 1]), 0, 1)
+    return (currents[:, i - 1] * (1 - w) + currents[:, i] * w) / CONDUCTANCE_VOLTAGE
+
+def conductance_colors(conductance):
+    """COLOR_PALETTE entry for each conductance, scaled between MIN_CONDUCTANCE and MAX_CONDUCTANCE."""
+    norm_g = np.clip((np.nan_to_num(np.asarray(conductance, dtype=float)) - MIN_CONDUCTANCE) / (MAX_CONDUCTANCE - MIN_CONDUCTANCE), 0, 1)
+    return np.asarray(COLOR_PALETTE)[(norm_g * (len(COLOR_PALETTE) - 1)).astype(int)].tolist()
 
 
 # --- Standalone Hardware Simulation Functions ---
@@ -173,6 +812,413 @@ def read_resistance(row, col, read_voltage_v):
         return None
     return final_r
 
+#################################################################
+# --- MUX Router (Arduino Mega 74LS595 controller) ---
+#################################################################
+MUX_GROUPS = ('muxBE12', 'muxBE34', 'ENABLE', 'muxTE') # command prefixes understood by the firmware
+
+def default_route_words(row, col):
+    """Register words that connect device (row, col), in MUX_GROUPS order. Default wiring:
+    the column is picked by MUX_TE1, the row by the same channel on all four MUX_BE12 muxes,
+    MUX_BE34 parked on channel 0 and ENABLE line 0 on. Replace to match the board."""
+    be12 = (row & 0x0F) * 0x1111
+    return (be12, 0x0000, 0x0001, col & 0x0F)
+
+MUX_FRAME_SYNC = 0xA5; MUX_ACK = 0x06; MUX_NAK = 0x15 # binary frame mode, see 'VRRAM aduino mega.md' 4.4
+
+def mux_crc8(data):
+    """CRC-8 (polynomial 0x07, init 0x00) as computed by the firmware's crc8()."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8): crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+MUX_ROUTE_GROUP_ID = 5
+MUX_TABLE_APPEND_ID = 6; MUX_TABLE_CONTROL_ID = 7; MUX_TABLE_CLEAR = 0; MUX_TABLE_ARM = 1
+MUX_NEXT_BYTE = 0xA6 # steps the armed route table by one entry
+MUX_MAX_ROUTE_TABLE = 256
+
+def encode_route_frame(words, sequence, group_id=MUX_ROUTE_GROUP_ID):
+    """Binary ROUTE frame latching all four MUX_GROUPS words (BE12, BE34, ENABLE, TE) at once.
+    With group_id=MUX_TABLE_APPEND_ID the route is stored as the next route table entry instead."""
+    be12, be34, enable, te = words
+    body = bytes((group_id, be12 >> 8, be12 & 0xFF, be34 >> 8, be34 & 0xFF, enable >> 8, enable & 0xFF, te & 0xFF, sequence & 0xFF))
+    return bytes((MUX_FRAME_SYNC,)) + body + bytes((mux_crc8(body),))
+
+class MuxRouter:
+    """Drives the 'VRRAM control Arduino Mega' sketch over serial.
+
+    route(row, col) maps the device to the four register words with route_words and latches
+    them all at once with the ROUTE command, skipping devices that are already routed. With
+    binary=True (default) each command is one CRC-checked frame answered by a single ACK byte;
+    binary=False uses the text commands.
+    Anything that measures through a route takes hold() (or hold_async()) first, so no other
+    thread can re-route the crossbar between the route and the measurement.
+    """
+    def __init__(self, port, baudrate=MUX_BAUDRATE, timeout=2.0, route_words=default_route_words, binary=True, retries=2):
+        import serial # pyserial is only needed when a MUX controller is attached
+        self.route_words = route_words; self.binary = binary; self.retries = retries
+        self._latched = {}; self._lock = threading.Lock(); self._sequence = 0
+        self._held = threading.Lock() # crossbar ownership, see hold(); any thread may release it
+        self.ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+        self._read_reply() # start-up banner and usage text
+        self._read_reply()
+        self.ser.reset_input_buffer()
+
+    def _read_reply(self):
+        # Every text command reply (and the banner) ends with the usage block's closing rule
+        return self.ser.read_until(b"--------------------------\r\n").decode(errors='replace')
+
+    def _send_text(self, command):
+        self.ser.write(f"{command}\n".encode())
+        reply = self._read_reply()
+        if "Error" in reply: raise IOError(f"MUX controller rejected '{command}': {reply.strip()}")
+
+    def _send_frame(self, frame, description):
+        for attempt in range(self.retries + 1): # same sequence on retry, the firmware will not latch twice
+            self.ser.write(frame)
+            reply = self.ser.read(1)
+            if reply == bytes((MUX_ACK,)): return
+        raise IOError(f"MUX controller did not ACK {description} (last reply {reply!r})")
+
+    def route(self, row, col):
+        """Routes device (row, col) with one ROUTE command, so all four groups latch together
+        and no neighbouring cell sees an intermediate route. Nothing is sent if already routed."""
+        words = tuple(self.route_words(row, col))
+        with self._lock:
+            if all(self._latched.get(group) == word for group, word in zip(MUX_GROUPS, words)): return False
+            if self.binary:
+                self._sequence = (self._sequence + 1) & 0xFF
+                self._send_frame(encode_route_frame(words, self._sequence), f"ROUTE R{row}C{col}")
+            else: self._send_text("ROUTE " + " ".join(f"0x{word:X}" for word in words))
+            self._latched.update(zip(MUX_GROUPS, words))
+            return True
+
+    def upload_route_table(self, devices):
+        """Stores the routes of devices [(row, col), ...] in the controller's route table and arms
+        it, which latches the first device. After that each trigger-input edge, or next_route(),
+        moves to the next device without any route data crossing the serial link."""
+        devices = list(devices)
+        if len(devices) > MUX_MAX_ROUTE_TABLE: raise ValueError(f"Route table holds at most {MUX_MAX_ROUTE_TABLE} devices, got {len(devices)}.")
+        with self._lock:
+            self._table_control(MUX_TABLE_CLEAR, "CLEAR")
+            for row, col in devices:
+                words = tuple(self.route_words(row, col))
+                if self.binary:
+                    self._sequence = (self._sequence + 1) & 0xFF
+                    self._send_frame(encode_route_frame(words, self._sequence, MUX_TABLE_APPEND_ID), f"TABLE ADD R{row}C{col}")
+                else: self._send_text("TABLE ADD " + " ".join(f"0x{word:X}" for word in words))
+            self._table_control(MUX_TABLE_ARM, "ARM")
+            self._latched.clear() # the table now owns the latches
+
+    def _table_control(self, command, name):
+        if self.binary:
+            self._sequence = (self._sequence + 1) & 0xFF
+            body = bytes((MUX_TABLE_CONTROL_ID, 0, command, self._sequence))
+            self._send_frame(bytes((MUX_FRAME_SYNC,)) + body + bytes((mux_crc8(body),)), f"TABLE {name}")
+        else: self._send_text(f"TABLE {name}")
+
+    def next_route(self):
+        """Steps the armed route table by one device (one byte each way). Raises IOError past the last entry."""
+        with self._lock:
+            if self.binary:
+                self.ser.write(bytes((MUX_NEXT_BYTE,)))
+                reply = self.ser.read(1)
+                if reply != bytes((MUX_ACK,)): raise IOError(f"MUX controller could not step the route table (reply {reply!r})")
+            else: self._send_text("TABLE NEXT")
+
+    @contextmanager
+    def hold(self, row=None, col=None, wait_s=60.0):
+        """Exclusive use of the crossbar for the with block, routed to (row, col) if given.
+        Take it before the instrument lease, so every caller locks router then instrument."""
+        if not self._held.acquire(timeout=wait_s): raise TimeoutError("MUX router is busy.")
+        try:
+            if row is not None: self.route(row, col)
+            yield self
+        finally: self._held.release()
+
+    @asynccontextmanager
+    async def hold_async(self, row=None, col=None, wait_s=60.0, poll_interval=SRQ_POLL_INTERVAL):
+        """hold() for coroutines: waits with asyncio.sleep and routes on the hardware executor."""
+        deadline = time.time() + wait_s
+        while not self._held.acquire(blocking=False):
+            if time.time() > deadline: raise TimeoutError("MUX router is busy.")
+            await asyncio.sleep(poll_interval)
+        try:
+            if row is not None: await asyncio.get_running_loop().run_in_executor(get_hardware_executor(), self.route, row, col)
+            yield self
+        finally: self._held.release()
+
+    def close(self): self.ser.close()
+
+def get_mux_router(backend=None):
+    """Returns the process-wide MuxRouter in front of back-end backend: its SCAN_MUX_PORTS entry,
+    else MUX_PORT (None when no controller is configured for it)."""
+    port = SCAN_MUX_PORTS.get(backend, MUX_PORT)
+    if port is None: return None
+    routers = pn.state.cache.setdefault('mux_routers', {})
+    if port not in routers: routers[port] = MuxRouter(port)
+    return routers[port]
+
+
+#################################################################
+# --- Parallel Array Scan ---
+#################################################################
+def iv_sweep_setup(vmin, vmax, step, compliance=0.001):
+    """2400 commands for a linear staircase voltage sweep reading VOLT,CURR,STAT. Returns (commands, num_points)."""
+    if step == 0: step = 0.01
+    num_points = int(np.floor((vmax - vmin) / step)) + 1
+    setup = [":SOUR:FUNC VOLT", ":SENS:FUNC 'CURR:DC'", f":SENS:CURR:PROT {compliance:.4e}",
+             f":SOUR:VOLT:STAR {vmin}", f":SOUR:VOLT:STOP {vmin + (num_points - 1) * step}", f":SOUR:SWE:POIN {num_points}",
+             ":SOUR:SWE:SPAC LIN", ":SOUR:VOLT:MODE SWE", f":TRIG:COUN {num_points}", ":FORM:ELEM VOLT,CURR,STAT"]
+    return setup, num_points
+
+def measure_iv_keithley(address, vmin, vmax, step, compliance=0.001, device=None):
+    """Linear staircase sweep on a 2400 through the instrument pool, read back as binary SREAL.
+    With device=(row, col) the sweep runs on the fixed current range its range hint calls for
+    at max(|vmin|, |vmax|), and is repeated on autorange if any point overflows or is flagged
+    in compliance or range compliance."""
+    setup, num_points = iv_sweep_setup(vmin, vmax, step, compliance)
+    v_peak = max(abs(vmin), abs(vmax))
+    with get_instrument_pool().lease(address, timeout_ms=25000) as instrument:
+        instrument.write(";".join(setup + [":FORM:DATA SREAL", ":FORM:BORD SWAP"]))
+        hinted = hinted_current_range(*device, v_peak) if device is not None else None
+        try:
+            for current_range in ([hinted, None] if hinted is not None else [None]):
+                set_current_range(instrument, address, current_range); instrument.write(":OUTP ON")
+                values = instrument.query_binary_values(":READ?", datatype='f', is_big_endian=False, container=np.array)
+                if current_range is None or not readings_out_of_range(values[1::3], values[2::3]): break
+                print(f"Sweep out of the {current_range:.2e} A range, repeating on autorange")
+        finally: instrument.write(":OUTP OFF;:FORM:DATA ASC")
+    if device is not None:
+        i_peak = np.max(np.abs(values[1::3]))
+        remember_resistance(*device, v_peak / i_peak if i_peak else None)
+    return dict(voltage=values[0::3].tolist(), current=values[1::3].tolist())
+
+# 2400 status model bits for SRQ-driven buffered acquisition
+TRACE_BUFFER_POINTS = 2500 # size of the :TRAC reading buffer
+MEAS_EVENT_BUFFER_FULL = 512 # measurement event register bit 9 (BFL)
+STB_MSB = 0x01 # status byte bit 0: measurement summary
+STB_RQS = 0x40 # status byte bit 6: RQS (serial poll) / MSS (*STB?)
+
+async def wait_for_srq_async(instrument, timeout_s=60.0, poll_interval=SRQ_POLL_INTERVAL):
+    """Waits until the instrument requests service without blocking the event loop.
+    Uses VISA service-request events where the interface has them (GPIB); otherwise,
+    e.g. over RS-232 where there is no SRQ line, polls the status byte with asyncio.sleep in between."""
+    loop = asyncio.get_running_loop(); srq = asyncio.Event(); deadline = loop.time() + timeout_s
+    event_type = pyvisa.constants.EventType.service_request; mechanism = pyvisa.constants.EventMechanism.handler
+    serial_link = instrument.interface_type == pyvisa.constants.InterfaceType.asrl
+    def _handler(resource, event, user_handle): loop.call_soon_threadsafe(srq.set)
+    def _status_byte(): return int(instrument.query("*STB?")) if serial_link else instrument.read_stb()
+    user_handle = None
+    if not serial_link:
+        try: user_handle = instrument.install_handler(event_type, _handler); instrument.enable_event(event_type, mechanism)
+        except (pyvisa.errors.VisaIOError, NotImplementedError) as e: print(f"SRQ events unavailable on {instrument.resource_name} ({e}), polling the status byte."); user_handle = None
+    try:
+        # Checked once up front too, the request may have come before the handler was installed
+        while not _status_byte() & STB_RQS:
+            remaining = deadline - loop.time()
+            if remaining <= 0: raise TimeoutError(f"No service request from {instrument.resource_name} within {timeout_s} s.")
+            if user_handle is None: await asyncio.sleep(min(poll_interval, remaining)); continue
+            try: await asyncio.wait_for(srq.wait(), remaining)
+            except asyncio.TimeoutError: raise TimeoutError(f"No service request from {instrument.resource_name} within {timeout_s} s.")
+            srq.clear()
+    finally:
+        if user_handle is not None:
+            try: instrument.disable_event(event_type, mechanism); instrument.uninstall_handler(event_type, _handler, user_handle)
+            except pyvisa.errors.VisaIOError as e: print(f"Error removing SRQ handler on {instrument.resource_name}: {e}")
+
+def arm_buffered_acquisition(instrument, setup):
+    """Runs the setup commands on a leased instrument, enables the buffer-full service request and
+    turns the output on. Follow with read_buffered_chunk calls and end with disarm_buffered_acquisition."""
+    instrument.write(";".join(["*CLS", *setup, ":FORM:DATA SREAL", ":FORM:BORD SWAP",
+                               f":STAT:MEAS:ENAB {MEAS_EVENT_BUFFER_FULL}", f"*SRE {STB_MSB}", ":OUTP ON"]))
+
+async def read_buffered_chunk(instrument, points, commands=(), timeout_s=60.0):
+    """On an armed instrument: sends commands (e.g. the next source list), refills the :TRAC buffer
+    with points readings, awaits the buffer-full service request and reads the buffer in one binary
+    transfer. The event loop keeps serving other sessions meanwhile."""
+    if points > TRACE_BUFFER_POINTS: raise ValueError(f"{points} readings do not fit the {TRACE_BUFFER_POINTS}-point buffer.")
+    instrument.write(";".join(["*CLS", *commands, ":TRAC:CLE", f":TRAC:POIN {points}", ":TRAC:FEED SENS", ":TRAC:FEED:CONT NEXT", ":INIT"]))
+    await wait_for_srq_async(instrument, timeout_s)
+    return instrument.query_binary_values(":TRAC:DATA?", datatype='f', is_big_endian=False, container=np.array)
+
+def disarm_buffered_acquisition(instrument, completed=True):
+    """Turns the output off and puts the buffer, status model and data format back; aborts first if not completed."""
+    if not completed: instrument.write(":ABOR")
+    instrument.write(":OUTP OFF;:FORM:DATA ASC;:TRAC:FEED:CONT NEV;:STAT:MEAS:ENAB 0;*SRE 0;*CLS")
+
+IV_STREAM_CHUNK = 20 # sweep points per chunk of a live I-V measurement
+IV_STREAM_ROLLOVER = 5000 # points the I-V plot keeps while streaming
+IV_STREAM_INTERVAL = 0.1 # s between pushes to the browser (about 10 Hz)
+
+async def measure_iv_keithley_async(address, vmin, vmax, step, compliance=0.001, device=None, on_chunk=None, chunk_points=IV_STREAM_CHUNK):
+    """measure_iv_keithley through the buffer and SRQ instead of a blocking :READ?, as consecutive
+    list sweeps of chunk_points on one lease. The output is switched on once for the whole sweep;
+    between chunks only the source list and trigger count change. on_chunk(dict(voltage=[...],
+    current=[...])) gets each chunk as it arrives. With device=(row, col) the chunks use its hinted
+    fixed current range, and a chunk that overflows or is flagged in (range) compliance is repeated
+    on autorange. Returns the whole curve."""
+    if step == 0: step = 0.01
+    num_points = int(np.floor((vmax - vmin) / step)) + 1
+    voltages = vmin + np.arange(num_points) * step
+    chunks = [voltages[start:start + chunk_points] for start in range(0, num_points, chunk_points)]
+    def _list_commands(chunk): return [":SOUR:LIST:VOLT " + ",".join(f"{v:.6g}" for v in chunk), f":TRIG:COUN {len(chunk)}"]
+    setup = [":SOUR:FUNC VOLT", ":SENS:FUNC 'CURR:DC'", f":SENS:CURR:PROT {compliance:.4e}", *_list_commands(chunks[0]), ":SOUR:VOLT:MODE LIST", ":FORM:ELEM VOLT,CURR,STAT"]
+    curve = dict(voltage=[], current=[])
+    async with get_instrument_pool().lease_async(address, timeout_ms=10000) as instrument:
+        current_range = hinted_current_range(*device, max(abs(vmin), abs(vmax))) if device is not None else None
+        completed = False
+        try:
+            set_current_range(instrument, address, current_range); arm_buffered_acquisition(instrument, setup)
+            for index, chunk in enumerate(chunks):
+                commands = _list_commands(chunk) if index else [] # the first list went out with the setup
+                while True:
+                    values = await read_buffered_chunk(instrument, len(chunk), commands)
+                    if current_range is None or not readings_out_of_range(values[1::3], values[2::3]): break
+                    print(f"Chunk out of the {current_range:.2e} A range, continuing on autorange")
+                    current_range = None; set_current_range(instrument, address, None); commands = []
+                data = dict(voltage=values[0::3].tolist(), current=values[1::3].tolist())
+                curve['voltage'] += data['voltage']; curve['current'] += data['current']
+                if on_chunk is not None: on_chunk(data)
+            completed = True
+        finally: disarm_buffered_acquisition(instrument, completed); instrument.write(":SOUR:VOLT:MODE FIX")
+    if device is not None and curve['current']:
+        i_peak = np.max(np.abs(curve['current'])); remember_resistance(*device, max(abs(vmin), abs(vmax)) / i_peak if i_peak else None)
+    return curve
+
+def simulate_iv_chunks(row, col, vmin, vmax, step, gate_v, chunk_points=IV_STREAM_CHUNK):
+    """simulate_iv_curve cut into dict(voltage=[...], current=[...]) chunks like measure_iv_keithley_async delivers."""
+    iv_data = simulate_iv_curve(row, col, vmin, vmax, step, gate_v)
+    for start in range(0, len(iv_data['voltage']), chunk_points):
+        yield {key: values[start:start + chunk_points] for key, values in iv_data.items()}
+
+class ThrottledStreamer:
+    """Collects rows pushed from any thread and hands them to cds.stream on the document's next
+    tick, at most once per interval, so the browser gets only new points at a bounded rate."""
+    def __init__(self, doc, cds, rollover=IV_STREAM_ROLLOVER, interval=IV_STREAM_INTERVAL):
+        self.doc = doc; self.cds = cds; self.rollover = rollover; self.interval = interval
+        self._lock = threading.Lock(); self._pending = {}; self._scheduled = False; self._last_flush = 0.0
+
+    def push(self, chunk):
+        with self._lock:
+            for key, values in chunk.items(): self._pending.setdefault(key, []).extend(values)
+            if self._scheduled: return
+            self._scheduled = True; delay = self._last_flush + self.interval - time.time()
+        # add_next_tick_callback is the thread-safe way into the document; the timer only delays it
+        if delay > 0: threading.Timer(delay, self.doc.add_next_tick_callback, args=(self._flush,)).start()
+        else: self.doc.add_next_tick_callback(self._flush)
+
+    def _flush(self):
+        with self._lock: new, self._pending = self._pending, {}; self._scheduled = False; self._last_flush = time.time()
+        if new: self.cds.stream(new, rollover=self.rollover)
+
+def measure_iv(backend, row, col, vmin, vmax, step, gate_v, compliance=0.001):
+    """Measures one device's I-V curve on the given scan back-end (see SCAN_BACKENDS), routed by its MUX controller."""
+    if backend.startswith("SIM"): return simulate_iv_curve(row, col, vmin, vmax, step, gate_v)
+    router = get_mux_router(backend)
+    with router.hold(row, col) if router is not None else nullcontext(): # nobody re-routes until the sweep is read
+        return measure_iv_keithley(backend, vmin, vmax, step, compliance, device=(row, col))
+
+def scan_array_trigger_link(address, router, devices, read_voltage=CONDUCTANCE_VOLTAGE, compliance=0.001, profile='default', stop_event=None):
+    """Hardware-paced conductance scan: devices [(row, col), ...] are uploaded to the MUX route table,
+    the 2400 measures on each "settled" pulse (:TRIG:SOUR TLIN) and steps the MUX with its output
+    trigger, and every reading goes to the :TRAC buffer. Python only starts the scan and fetches
+    the buffer once per table (MUX_MAX_ROUTE_TABLE devices). Returns the current of each device;
+    setting stop_event ends the scan after the current table, so fewer currents come back."""
+    currents = []
+    with router.hold(), get_instrument_pool().lease(address, timeout_ms=120000) as instrument:
+        apply_measurement_profile(instrument, address, profile)
+        for start in range(0, len(devices), MUX_MAX_ROUTE_TABLE):
+            if stop_event is not None and stop_event.is_set(): break
+            chunk = devices[start:start + MUX_MAX_ROUTE_TABLE]; n = len(chunk)
+            setup = ["*CLS", ":SOUR:FUNC VOLT", ":SOUR:VOLT:MODE FIXED", f":SOUR:VOLT {read_voltage}",
+                     ":SENS:FUNC 'CURR'", f":SENS:CURR:PROT {compliance:.4e}", ":FORM:ELEM CURR",
+                     ":ARM:SOUR IMM", ":ARM:COUN 1", ":TRIG:SOUR TLIN", f":TRIG:ILIN {TLINK_SMU_INPUT_LINE}", f":TRIG:OLIN {TLINK_SMU_OUTPUT_LINE}",
+                     ":TRIG:INP SOUR", ":TRIG:OUTP SENS", f":TRIG:COUN {n}", ":TRIG:DEL 0",
+                     ":TRAC:CLE", f":TRAC:POIN {n}", ":TRAC:FEED SENS", ":TRAC:FEED:CONT NEXT", ":OUTP ON", ":INIT"]
+            instrument.write(";".join(setup))
+            try:
+                router.upload_route_table(chunk) # arming latches the first device and fires the first settled pulse
+                instrument.query("*OPC?") # returns once all n triggers have been measured
+                instrument.write(":FORM:DATA SREAL;:FORM:BORD SWAP")
+                currents.extend(instrument.query_binary_values(":TRAC:DATA?", datatype='f', is_big_endian=False))
+            finally: instrument.write(":OUTP OFF;:TRIG:SOUR IMM;:FORM:DATA ASC")
+    return np.asarray(currents)
+
+# Screening bins, the Digital I/O pattern each is output as, and the grid colour it is shown in
+SCREEN_PASS = 0; SCREEN_LOW = 1; SCREEN_HIGH = 2; SCREEN_COMPLIANCE = 3
+SCREEN_DIO_PATTERNS = {SCREEN_PASS: 4, SCREEN_LOW: 1, SCREEN_HIGH: 2, SCREEN_COMPLIANCE: 3}
+SCREEN_BIN_COLORS = {SCREEN_PASS: "#2ca02c", SCREEN_LOW: "#7f7f7f", SCREEN_HIGH: "#ff7f0e", SCREEN_COMPLIANCE: "#d62728"}
+
+def screen_array_limits(address, router, devices, g_low=SCREEN_MIN_CONDUCTANCE, g_high=SCREEN_MAX_CONDUCTANCE, read_voltage=CONDUCTANCE_VOLTAGE,
+                        compliance=0.001, profile=SCREEN_PROFILE, digital_io=SCREEN_DIGITAL_IO):
+    """Go/no-go screen of devices [(row, col), ...] with the 2400's own limit tests: limit 1 flags
+    compliance, limit 2 the current band read_voltage * [g_low, g_high]. Both are set up once, then
+    each device costs one read and its CALC2 results instead of a full I-V sweep. With digital_io the
+    bins also go out on the Digital I/O port (SCREEN_DIO_PATTERNS) for a handler.
+    Returns one SCREEN_* bin per device."""
+    i_low = g_low * read_voltage; i_high = g_high * read_voltage
+    setup = ["*CLS", ":SOUR:FUNC VOLT", ":SOUR:VOLT:MODE FIX", f":SOUR:VOLT {read_voltage}", ":SENS:FUNC 'CURR:DC'",
+             f":SENS:CURR:PROT {compliance:.4e}", ":TRIG:COUN 1", ":CALC2:FEED CURR",
+             ":CALC2:LIM:COMP:FAIL IN", ":CALC2:LIM:STAT ON", f":CALC2:LIM2:LOW {i_low:.6e}", f":CALC2:LIM2:UPP {i_high:.6e}",
+             ":CALC2:LIM2:STAT ON", ":CALC2:CLIM:CLE:AUTO ON"]
+    if digital_io:
+        setup += [":CALC2:CLIM:MODE GRAD", ":CALC2:CLIM:BCON IMM", f":CALC2:CLIM:PASS:SOUR2 {SCREEN_DIO_PATTERNS[SCREEN_PASS]}",
+                  f":CALC2:LIM:COMP:SOUR2 {SCREEN_DIO_PATTERNS[SCREEN_COMPLIANCE]}", f":CALC2:LIM2:LOW:SOUR2 {SCREEN_DIO_PATTERNS[SCREEN_LOW]}",
+                  f":CALC2:LIM2:UPP:SOUR2 {SCREEN_DIO_PATTERNS[SCREEN_HIGH]}"]
+    bins = []
+    with router.hold() if router is not None else nullcontext(), get_instrument_pool().lease(address, timeout_ms=10000) as instrument:
+        instrument.write(";".join(setup)); apply_measurement_profile(instrument, address, profile); instrument.write(":OUTP ON")
+        try:
+            for row, col in devices:
+                if router is not None: router.route(row, col)
+                hinted = hinted_current_range(row, col, read_voltage)
+                for current_range in ([hinted, None] if hinted is not None else [None]):
+                    set_current_range(instrument, address, current_range)
+                    compliance_fail, band_fail, current = instrument.query(":INIT;*WAI;:CALC2:LIM:FAIL?;:CALC2:LIM2:FAIL?;:CALC2:DATA:LAT?").split(";")
+                    if not int(compliance_fail) and abs(float(current)) < OVERFLOW_READING: break # else the fixed range was too low
+                remember_resistance(row, col, read_voltage / float(current) if float(current) else None)
+                if int(compliance_fail): bins.append(SCREEN_COMPLIANCE)
+                elif not int(band_fail): bins.append(SCREEN_PASS)
+                else: bins.append(SCREEN_LOW if float(current) < i_low else SCREEN_HIGH)
+        finally: instrument.write(":OUTP OFF;:CALC2:LIM:STAT OFF;:CALC2:LIM2:STAT OFF;:CALC2:CLIM:CLE")
+    return np.asarray(bins)
+
+def screen_array_simulated(rows, cols, g_low=SCREEN_MIN_CONDUCTANCE, g_high=SCREEN_MAX_CONDUCTANCE, read_voltage=CONDUCTANCE_VOLTAGE, seed=None):
+    """screen_array_limits on the simulator: one simulated read per device, binned the same way."""
+    _, current = simulate_iv_array(rows, cols, read_voltage, read_voltage, 1.0, FULL_SCAN_GATE, seed=seed)
+    conductance = current[:, 0] / read_voltage
+    return np.select([conductance < g_low, conductance > g_high], [SCREEN_LOW, SCREEN_HIGH], SCREEN_PASS)
+
+def scan_backend_routers(backends):
+    """{backend: MuxRouter} for the hardware back-ends of a per-device scan, opening the controllers.
+    Raises ValueError unless each has a MUX controller of its own: without one a 2400 only reaches
+    the cell it is wired to, and back-ends behind one controller would take turns on its hold()."""
+    routers = {backend: get_mux_router(backend) for backend in backends if not backend.startswith("SIM")}
+    missing = [backend for backend, router in routers.items() if router is None]
+    if missing: raise ValueError(f"No MUX controller for {', '.join(missing)}: set MUX_PORT or SCAN_MUX_PORTS.")
+    if len(set(map(id, routers.values()))) < len(routers): raise ValueError("Hardware scan back-ends share a MUX controller: give each its own in SCAN_MUX_PORTS.")
+    return routers
+
+def run_parallel_scan(devices, backends, measure, on_result, stop_event=None):
+    """Splits devices [(idx, row, col), ...] into one contiguous share per back-end and
+    measures the shares concurrently, one worker thread per back-end.
+    measure(backend, row, col) returns the I-V data, on_result(idx, row, col, iv_data)
+    is called from the worker thread as soon as each device is done. Hardware back-ends only run
+    concurrently behind MUX controllers of their own (scan_backend_routers checks that first)."""
+    n = len(backends)
+    shares = [devices[i * len(devices) // n:(i + 1) * len(devices) // n] for i in range(n)]
+    def worker(backend, share):
+        for idx, row, col in share:
+            if stop_event is not None and stop_event.is_set(): return
+            on_result(idx, row, col, measure(backend, row, col))
+    with ThreadPoolExecutor(max_workers=n, thread_name_prefix="array_scan") as executor:
+        futures = [executor.submit(worker, backend, share) for backend, share in zip(backends, shares)]
+        for future in futures: future.result() # re-raise the first worker error
+
+
 #################################################################
 # --- Bokeh Plot and CDS Creation ---
 #################################################################
@@ -235,11 +1281,16 @@ def ispp_tune_resistance_adaptive(
     reset_pulse_amplitude_step=-0.1,
     reset_pulse_width=1e-6,
     # --- Optional delay ---
-    delay_between_steps=0.01
+    delay_between_steps=0.01,
+    # --- Worker thread hooks ---
+    progress_callback=None,
+    stop_event=None
     ):
     """
     Tunes memristor resistance using ISPP with adaptive amplitude for BOTH SET and RESET.
     Returns history of the process.
+    progress_callback(iteration, max_iterations, resistance) is called after every read;
+    setting stop_event (a threading.Event) aborts the loop before the next read.
     """
     print(f"\n--- Starting Adaptive ISPP for R{row}C{col} ---")
     print(f"Target: {target_resistance:.2f} Ohms (+/- {tolerance*100:.1f}%)")
@@ -265,8 +1316,13 @@ def ispp_tune_resistance_adaptive(
         print(f"\nIteration {current_iter}/{max_iterations}")
         print(f"Current Amplitudes: SET={current_set_amplitude:.3f}V, RESET={current_reset_amplitude:.3f}V")
 
+        if stop_event is not None and stop_event.is_set():
+            print("ISPP cancelled.")
+            break
+
         current_resistance = read_resistance(row, col, read_voltage)
         final_resistance = current_resistance
+        if progress_callback is not None: progress_callback(current_iter, max_iterations, current_resistance)
 
         history['iteration'].append(current_iter)
         history['resistance'].append(current_resistance)
@@ -354,6 +1410,315 @@ def ispp_tune_resistance_adaptive(
     return success, final_resistance, history
 
 
+# --- Source-Memory ISPP (sequence runs on the 2400) ---
+SOURCE_MEMORY_SLOTS = 100 # :SOUR:MEM locations 1-100
+ISPP_RANGE_HEADROOM = 10.0 # range of the burst reads: current at the low end of the target band * this
+ISPP_BATCH_BURST_PULSES = 8 # pulses per device and round in a hardware batch ISPP run
+
+def compile_ispp_memory_sweep(amplitudes, pulse_width, read_voltage, current_low, current_high, compliance=0.001, read_range=None):
+    """
+    Compiles one ISPP burst into 2400 source-memory locations: read, pulse amplitudes[0], read,
+    pulse amplitudes[1], ..., read, park. Every read runs limit 2 on the current with the pass band
+    [current_low, current_high]; a passing read branches (:CALC2:CLIM:PASS:SML) to the park location,
+    0 V with no test, which branches to itself for whatever is left of the trigger count.
+    So the instrument stops programming as soon as the device is in band, without the host.
+    At most (SOURCE_MEMORY_SLOTS - 2) // 2 pulses fit; the rest of amplitudes is ignored.
+    The locations save the measurement profile active at compile time; a pulse lasts pulse_width
+    (source delay) plus one reading of that profile. With read_range (A) the read locations save that
+    fixed current range; pulse and park locations always save autorange, since a pulse draws far more
+    current than a read and would only be clamped by a read range.
+    Returns (writes, slots): writes are ';'-joined command strings, one per location so each stays
+    short for the 2400 input buffer; slots is [('read'|'pulse'|'park', voltage), ...] per location.
+    """
+    amplitudes = list(amplitudes)[:(SOURCE_MEMORY_SLOTS - 2) // 2]
+    slots = []
+    for amplitude in amplitudes: slots += [('read', read_voltage), ('pulse', amplitude)]
+    slots += [('read', read_voltage), ('park', 0.0)]; park = len(slots)
+    writes = [";".join(["*CLS", ":SOUR:FUNC VOLT", ":SOUR:VOLT:MODE FIX", ":SENS:FUNC 'CURR:DC'", f":SENS:CURR:PROT {compliance:.4e}",
+                        ":CALC2:FEED CURR", f":CALC2:LIM2:LOW {current_low:.6e}", f":CALC2:LIM2:UPP {current_high:.6e}"])]
+    read_ranging = ":SENS:CURR:RANG:AUTO ON" if read_range is None else f":SENS:CURR:RANG:AUTO OFF;:SENS:CURR:RANG {read_range:.4e}"
+    for location, (kind, voltage) in enumerate(slots, start=1):
+        ranging = read_ranging if kind == 'read' else ":SENS:CURR:RANG:AUTO ON"
+        if kind == 'read': branch = [":CALC2:LIM2:STAT ON", f":CALC2:CLIM:PASS:SML {park}", ":CALC2:CLIM:FAIL:SML NEXT"]
+        elif kind == 'pulse': branch = [":CALC2:LIM2:STAT OFF", ":CALC2:CLIM:PASS:SML NEXT", ":CALC2:CLIM:FAIL:SML NEXT"]
+        else: branch = [":CALC2:LIM2:STAT OFF", f":CALC2:CLIM:PASS:SML {park}", f":CALC2:CLIM:FAIL:SML {park}"]
+        writes.append(";".join([f":SOUR:VOLT {voltage}", f":SOUR:DEL {pulse_width if kind == 'pulse' else 0}", ranging, *branch, f":SOUR:MEM:SAVE {location}"]))
+    writes.append(";".join([":SOUR:FUNC MEM", ":SOUR:MEM:STAR 1", f":SOUR:MEM:POIN {park}", f":TRIG:COUN {park}", ":FORM:ELEM VOLT,CURR,STAT", ":FORM:DATA SREAL", ":FORM:BORD SWAP"]))
+    return writes, slots
+
+def run_ispp_memory_burst(instrument, amplitudes, pulse_width, read_voltage, band, compliance=0.001, read_range=None):
+    """Loads and runs one compile_ispp_memory_sweep burst on the leased 2400 (output on) and replays
+    the instrument's path through the slots: it left for the park location at the first read in band.
+    Returns [(kind, voltage, current, status), ...] for the read and pulse locations it ran."""
+    writes, slots = compile_ispp_memory_sweep(amplitudes, pulse_width, read_voltage, *band, compliance=compliance, read_range=read_range)
+    for command in writes: instrument.write(command)
+    values = instrument.query_binary_values(":READ?", datatype='f', is_big_endian=False, container=np.array)
+    instrument.write(":FORM:DATA ASC")
+    path = []
+    for (kind, voltage), current, status in zip(slots, values[1::3], values[2::3]):
+        if kind == 'park': break
+        path.append((kind, voltage, float(current), int(status)))
+        if kind == 'read' and band[0] <= current <= band[1]: break
+    return path
+
+def reread_current_autorange(instrument, read_voltage):
+    """One :READ? at read_voltage on autorange after a memory sweep, for a burst read clamped to its range."""
+    instrument.write(f":SOUR:FUNC VOLT;:SOUR:VOLT {read_voltage};:TRIG:COUN 1;:FORM:ELEM CURR;:FORM:DATA ASC;:SENS:CURR:RANG:AUTO ON")
+    return float(instrument.query(":READ?"))
+
+def ispp_tune_resistance_memory_sweep(
+    address, row, col,
+    target_resistance,
+    tolerance=0.05,
+    read_voltage=0.1,
+    max_iterations=100,
+    set_pulse_initial_amplitude=0.35,
+    set_pulse_max_amplitude=3.0,
+    set_pulse_amplitude_step=0.1,
+    set_pulse_width=1e-6,
+    reset_pulse_initial_amplitude=-0.5,
+    reset_pulse_max_amplitude=-3.0,
+    reset_pulse_amplitude_step=-0.1,
+    reset_pulse_width=1e-6,
+    compliance=0.001,
+    read_noise_floor=MEASUREMENT_PROFILES['ispp_verify'].noise_floor,
+    progress_callback=None,
+    stop_event=None
+    ):
+    """
+    ispp_tune_resistance_adaptive on a 2400 at address, with the pulse/read loop compiled into
+    source memory (compile_ispp_memory_sweep) and run as one memory sweep per burst. The host only
+    picks the polarity: a SET burst passes once R <= max target, a RESET burst once R >= min target;
+    an overshoot starts a burst of the other polarity with its amplitude back at the initial value.
+    Reads use the fastest measurement profile that meets read_noise_floor (A).
+    Same return value and history as ispp_tune_resistance_adaptive.
+    """
+    print(f"\n--- Starting Source-Memory ISPP for R{row}C{col} on {address} ---")
+    min_target = target_resistance * (1.0 - tolerance); max_target = target_resistance * (1.0 + tolerance)
+    set_amp = set_pulse_initial_amplitude; reset_amp = reset_pulse_initial_amplitude; polarity = None
+    history = {'iteration': [], 'resistance': [], 'set_amplitude_applied': [], 'reset_amplitude_applied': []}
+    success = False; resistance = None
+    with get_instrument_pool().lease(address, timeout_ms=30000) as instrument:
+        try:
+            instrument.write(f"*CLS;:SOUR:FUNC VOLT;:SOUR:VOLT:MODE FIX;:SOUR:VOLT {read_voltage};:SENS:FUNC 'CURR:DC';:SENS:CURR:PROT {compliance:.4e};:FORM:ELEM CURR;:TRIG:COUN 1")
+            apply_measurement_profile(instrument, address, select_measurement_profile(read_noise_floor)); instrument.write(":OUTP ON")
+            current = read_current_ranged(instrument, address, row, col, read_voltage); resistance = read_voltage / current if current > 0 else np.inf
+            # Every burst read lands near the target, so the read locations share one fixed range; the
+            # pulse locations autorange. A read beyond that range is clamped to it and flagged in STAT.
+            read_range = min(read_voltage / min_target * ISPP_RANGE_HEADROOM, MAX_CURRENT_RANGE)
+            while len(history['iteration']) < max_iterations and not (stop_event is not None and stop_event.is_set()):
+                if min_target <= resistance <= max_target: success = True; break
+                if polarity != (resistance > max_target): # polarity change: restart the other ramp
+                    polarity = resistance > max_target; set_amp = set_pulse_initial_amplitude; reset_amp = reset_pulse_initial_amplitude
+                steps = max(1, min(max_iterations - len(history['iteration']) - 1, (SOURCE_MEMORY_SLOTS - 2) // 2))
+                if polarity: # SET lowers R: pass once R <= max_target
+                    amplitudes = [min(set_amp + k * set_pulse_amplitude_step, set_pulse_max_amplitude) for k in range(steps)]
+                    band = (read_voltage / max_target, compliance); width = set_pulse_width
+                else: # RESET raises R: pass once R >= min_target
+                    amplitudes = [max(reset_amp + k * reset_pulse_amplitude_step, reset_pulse_max_amplitude) for k in range(steps)]
+                    band = (-compliance, read_voltage / min_target); width = reset_pulse_width
+                clamped = False
+                for kind, voltage, current, status in run_ispp_memory_burst(instrument, amplitudes, width, read_voltage, band, compliance, read_range):
+                    if len(history['iteration']) >= max_iterations: break
+                    if kind == 'pulse':
+                        history['set_amplitude_applied' if voltage > 0 else 'reset_amplitude_applied'][-1] = voltage
+                        if polarity: set_amp = min(voltage + set_pulse_amplitude_step, set_pulse_max_amplitude)
+                        else: reset_amp = max(voltage + reset_pulse_amplitude_step, reset_pulse_max_amplitude)
+                        continue
+                    resistance = read_voltage / current if current > 0 else np.inf; clamped = readings_out_of_range(current, status)
+                    history['iteration'].append(len(history['iteration']) + 1); history['resistance'].append(resistance)
+                    history['set_amplitude_applied'].append(np.nan); history['reset_amplitude_applied'].append(np.nan)
+                    if progress_callback is not None: progress_callback(history['iteration'][-1], max_iterations, resistance)
+                if clamped: # the read that decides the next burst was clamped to read_range: read it again on autorange
+                    current = reread_current_autorange(instrument, read_voltage); resistance = read_voltage / current if current > 0 else np.inf
+                    history['resistance'][-1] = resistance
+        finally: instrument.write(":OUTP OFF;:SOUR:FUNC VOLT;:CALC2:LIM2:STAT OFF;:TRIG:COUN 1;:FORM:DATA ASC")
+    remember_resistance(row, col, resistance)
+    if not success and min_target <= resistance <= max_target: success = True
+    print(f"--- Source-Memory ISPP Finished for R{row}C{col}: {'success' if success else 'failed'}, R = {resistance:.2f} Ohms ---")
+    return success, resistance, history
+
+
+# --- Batch ISPP Routine ---
+def ispp_route_group(row, col, route_words=default_route_words):
+    """Sort key built from the MUX register words of device (row, col), the words MuxRouter keeps
+    latched: ENABLE, BE34 and BE12 first and the per-device TE word last. Devices that share
+    the outer words end up next to each other, so consecutive visits only re-latch what differs."""
+    be12, be34, enable, te = route_words(row, col)
+    return (enable, be34, be12, te)
+
+def ispp_batch_devices(targets, router=None):
+    """Devices of a target matrix that have a finite target, in ispp_route_group order."""
+    route_words = router.route_words if router is not None else default_route_words
+    return sorted(((int(r), int(c)) for r, c in zip(*np.nonzero(np.isfinite(targets)))), key=lambda rc: ispp_route_group(*rc, route_words))
+
+def ispp_tune_array_adaptive(
+    target_resistances,
+    tolerance=0.05,
+    read_voltage=0.1,
+    max_iterations=100,
+    set_pulse_initial_amplitude=0.35,
+    set_pulse_max_amplitude=3.0,
+    set_pulse_amplitude_step=0.1,
+    set_pulse_width=1e-6,
+    reset_pulse_initial_amplitude=-0.5,
+    reset_pulse_max_amplitude=-3.0,
+    reset_pulse_amplitude_step=-0.1,
+    reset_pulse_width=1e-6,
+    delay_between_steps=0.01,
+    progress_callback=None,
+    stop_event=None
+    ):
+    """
+    Tunes a whole array towards a target-resistance matrix (NaN entries are skipped) with the
+    same adaptive SET/RESET scheme as ispp_tune_resistance_adaptive, but interleaved: every round
+    does one read (and pulse if needed) on each unconverged device, visited in ispp_route_group
+    order, and waits delay_between_steps once per round instead of once per device. Converged
+    devices drop out after max(iterations) rounds at most. Reads and pulses still run one device
+    at a time, so only the settling delay is shared: the run takes sum(iterations) reads/pulses
+    plus max(iterations) delays, instead of sum(iterations) of both. Reads and pulses go to the
+    simulated devices (read_resistance, apply_voltage_pulse); ispp_tune_array_memory_sweep is the
+    hardware version.
+    Returns {(row, col): {'success', 'final_resistance', 'iterations', 'history'}}.
+    progress_callback(round, max_iterations, active, converged) is called after every round.
+    """
+    targets = np.asarray(target_resistances, dtype=float)
+    devices = ispp_batch_devices(targets, get_mux_router())
+    print(f"\n--- Starting Batch ISPP on {len(devices)} devices ---")
+    states = {}
+    for r, c in devices:
+        target = targets[r, c]
+        states[(r, c)] = {'min_target': target * (1.0 - tolerance), 'max_target': target * (1.0 + tolerance),
+                          'set_amp': set_pulse_initial_amplitude, 'reset_amp': reset_pulse_initial_amplitude,
+                          'success': False, 'done': False, 'final_resistance': None, 'iterations': 0,
+                          'history': {'iteration': [], 'resistance': [], 'set_amplitude_applied': [], 'reset_amplitude_applied': []}}
+    converged = 0
+    for round_index in range(1, max_iterations + 1):
+        active = [rc for rc in devices if not states[rc]['done']]
+        if not active or (stop_event is not None and stop_event.is_set()): break
+        for r, c in active:
+            st = states[(r, c)]; hist = st['history']
+            resistance = read_resistance(r, c, read_voltage)
+            st['final_resistance'] = resistance; st['iterations'] = round_index
+            hist['iteration'].append(round_index); hist['resistance'].append(resistance)
+            set_applied = reset_applied = np.nan
+            if resistance is None:
+                print(f"Error: Failed to read R{r}C{c}. Dropping it from the batch.")
+                st['done'] = True
+            elif st['min_target'] <= resistance <= st['max_target']:
+                st['success'] = st['done'] = True; converged += 1
+            elif resistance > st['max_target']:
+                set_applied = min(st['set_amp'], set_pulse_max_amplitude)
+                if apply_voltage_pulse(r, c, set_applied, set_pulse_width):
+                    st['set_amp'] = min(st['set_amp'] + set_pulse_amplitude_step, set_pulse_max_amplitude); st['reset_amp'] = reset_pulse_initial_amplitude
+                else: st['done'] = True
+            else:
+                reset_applied = max(st['reset_amp'], reset_pulse_max_amplitude)
+                if apply_voltage_pulse(r, c, reset_applied, reset_pulse_width):
+                    st['reset_amp'] = max(st['reset_amp'] + reset_pulse_amplitude_step, reset_pulse_max_amplitude); st['set_amp'] = set_pulse_initial_amplitude
+                else: st['done'] = True
+            hist['set_amplitude_applied'].append(set_applied); hist['reset_amplitude_applied'].append(reset_applied)
+        if progress_callback is not None: progress_callback(round_index, max_iterations, sum(not states[rc]['done'] for rc in devices), converged)
+        if delay_between_steps > 0: time.sleep(delay_between_steps)
+    print(f"--- Batch ISPP Finished: {converged}/{len(devices)} devices converged ---")
+    return {rc: {'success': st['success'], 'final_resistance': st['final_resistance'], 'iterations': st['iterations'], 'history': st['history']} for rc, st in states.items()}
+
+def ispp_tune_array_memory_sweep(
+    address,
+    target_resistances,
+    tolerance=0.05,
+    read_voltage=0.1,
+    max_iterations=100,
+    set_pulse_initial_amplitude=0.35,
+    set_pulse_max_amplitude=3.0,
+    set_pulse_amplitude_step=0.1,
+    set_pulse_width=1e-6,
+    reset_pulse_initial_amplitude=-0.5,
+    reset_pulse_max_amplitude=-3.0,
+    reset_pulse_amplitude_step=-0.1,
+    reset_pulse_width=1e-6,
+    burst_pulses=ISPP_BATCH_BURST_PULSES,
+    compliance=0.001,
+    read_noise_floor=MEASUREMENT_PROFILES['ispp_verify'].noise_floor,
+    delay_between_steps=0.01,
+    progress_callback=None,
+    stop_event=None
+    ):
+    """
+    ispp_tune_array_adaptive on a 2400 at address, reaching the devices through the MUX controller.
+    Every round routes each unconverged device once, in ispp_route_group order, and runs one
+    source-memory burst of at most burst_pulses pulses on it (run_ispp_memory_burst), with the
+    polarity picked as in ispp_tune_resistance_memory_sweep. A device's first visit starts with one
+    ranged read. The router is held and the instrument leased for the whole run. iterations counts
+    the burst reads of a device, at most max_iterations.
+    Same return value and progress_callback as ispp_tune_array_adaptive.
+    """
+    router = get_mux_router(address)
+    if router is None: raise ValueError(f"Batch ISPP on {address} needs a MUX controller (MUX_PORT or SCAN_MUX_PORTS) to reach every device.")
+    targets = np.asarray(target_resistances, dtype=float)
+    devices = ispp_batch_devices(targets, router)
+    print(f"\n--- Starting Source-Memory Batch ISPP on {len(devices)} devices on {address} ---")
+    states = {}
+    for r, c in devices:
+        target = targets[r, c]
+        states[(r, c)] = {'min_target': target * (1.0 - tolerance), 'max_target': target * (1.0 + tolerance),
+                          'set_amp': set_pulse_initial_amplitude, 'reset_amp': reset_pulse_initial_amplitude, 'polarity': None,
+                          'success': False, 'done': False, 'final_resistance': None, 'iterations': 0,
+                          'history': {'iteration': [], 'resistance': [], 'set_amplitude_applied': [], 'reset_amplitude_applied': []}}
+    converged = 0; round_index = 0
+    with router.hold(), get_instrument_pool().lease(address, timeout_ms=30000) as instrument:
+        try:
+            instrument.write(f"*CLS;:SOUR:FUNC VOLT;:SOUR:VOLT:MODE FIX;:SOUR:VOLT {read_voltage};:SENS:FUNC 'CURR:DC';:SENS:CURR:PROT {compliance:.4e};:FORM:ELEM CURR;:TRIG:COUN 1")
+            apply_measurement_profile(instrument, address, select_measurement_profile(read_noise_floor)); instrument.write(":OUTP ON")
+            while not (stop_event is not None and stop_event.is_set()):
+                active = [rc for rc in devices if not states[rc]['done']]
+                if not active: break
+                round_index += 1
+                for r, c in active:
+                    if stop_event is not None and stop_event.is_set(): break
+                    st = states[(r, c)]; hist = st['history']
+                    router.route(r, c)
+                    resistance = st['final_resistance']
+                    if resistance is None: # first visit: a ranged read picks the first polarity
+                        instrument.write(f":SOUR:FUNC VOLT;:SOUR:VOLT {read_voltage};:TRIG:COUN 1")
+                        current = read_current_ranged(instrument, address, r, c, read_voltage); resistance = read_voltage / current if current > 0 else np.inf
+                    if not st['min_target'] <= resistance <= st['max_target'] and st['iterations'] < max_iterations:
+                        polarity = resistance > st['max_target']
+                        if st['polarity'] != polarity: # polarity change: restart the other ramp
+                            st['polarity'] = polarity; st['set_amp'] = set_pulse_initial_amplitude; st['reset_amp'] = reset_pulse_initial_amplitude
+                        steps = max(1, min(max_iterations - st['iterations'] - 1, burst_pulses))
+                        if polarity: # SET lowers R: pass once R <= max target
+                            amplitudes = [min(st['set_amp'] + k * set_pulse_amplitude_step, set_pulse_max_amplitude) for k in range(steps)]
+                            band = (read_voltage / st['max_target'], compliance); width = set_pulse_width
+                        else: # RESET raises R: pass once R >= min target
+                            amplitudes = [max(st['reset_amp'] + k * reset_pulse_amplitude_step, reset_pulse_max_amplitude) for k in range(steps)]
+                            band = (-compliance, read_voltage / st['min_target']); width = reset_pulse_width
+                        read_range = min(read_voltage / st['min_target'] * ISPP_RANGE_HEADROOM, MAX_CURRENT_RANGE); clamped = False
+                        for kind, voltage, current, status in run_ispp_memory_burst(instrument, amplitudes, width, read_voltage, band, compliance, read_range):
+                            if st['iterations'] >= max_iterations: break
+                            if kind == 'pulse':
+                                hist['set_amplitude_applied' if voltage > 0 else 'reset_amplitude_applied'][-1] = voltage
+                                if polarity: st['set_amp'] = min(voltage + set_pulse_amplitude_step, set_pulse_max_amplitude)
+                                else: st['reset_amp'] = max(voltage + reset_pulse_amplitude_step, reset_pulse_max_amplitude)
+                                continue
+                            resistance = read_voltage / current if current > 0 else np.inf; clamped = readings_out_of_range(current, status)
+                            st['iterations'] += 1; hist['iteration'].append(st['iterations']); hist['resistance'].append(resistance)
+                            hist['set_amplitude_applied'].append(np.nan); hist['reset_amplitude_applied'].append(np.nan)
+                        if clamped: # the read that decides the next burst was clamped to read_range: read it again on autorange
+                            current = reread_current_autorange(instrument, read_voltage); resistance = read_voltage / current if current > 0 else np.inf
+                            hist['resistance'][-1] = resistance
+                    st['final_resistance'] = resistance
+                    if st['min_target'] <= resistance <= st['max_target']: st['success'] = st['done'] = True; converged += 1
+                    elif st['iterations'] >= max_iterations: st['done'] = True
+                if progress_callback is not None: progress_callback(round_index, max_iterations, sum(not states[rc]['done'] for rc in devices), converged)
+                if delay_between_steps > 0: time.sleep(delay_between_steps)
+        finally: instrument.write(":OUTP OFF;:SOUR:FUNC VOLT;:CALC2:LIM2:STAT OFF;:TRIG:COUN 1;:FORM:DATA ASC")
+    for (r, c), st in states.items():
+        if st['final_resistance'] is not None: remember_resistance(r, c, st['final_resistance'])
+    print(f"--- Source-Memory Batch ISPP Finished: {converged}/{len(devices)} devices converged ---")
+    return {rc: {'success': st['success'], 'final_resistance': st['final_resistance'], 'iterations': st['iterations'], 'history': st['history']} for rc, st in states.items()}
+
+
 # --- Plotting Function (Returns Figure) ---
 def plot_ispp_history(history, target_resistance, tolerance, row, col):
     """Plots ISPP history and returns the Matplotlib Figure object."""
@@ -391,6 +1756,19 @@ def plot_ispp_history(history, target_resistance, tolerance, row, col):
     return fig
 
 
+def plot_batch_ispp_result(results, size=GRID_SIZE):
+    """Plots per-device iteration counts for a batch ISPP run; unconverged devices are hatched."""
+    iterations = np.full((size, size), np.nan); failed = np.zeros((size, size), dtype=bool)
+    for (r, c), res in results.items(): iterations[r, c] = res['iterations']; failed[r, c] = not res['success']
+    fig, ax = plt.subplots(figsize=(6, 5))
+    im = ax.imshow(iterations, origin='lower', cmap='viridis'); fig.colorbar(im, ax=ax, label='Iterations')
+    ax.contourf(np.ma.masked_where(~failed, failed.astype(float)), levels=[0.5, 1.5], hatches=['xx'], colors='none')
+    ax.set_xlabel('Col'); ax.set_ylabel('Row')
+    ax.set_title(f'Batch ISPP: {sum(r["success"] for r in results.values())}/{len(results)} converged (hatched = failed)', fontsize=11)
+    fig.tight_layout(); plt.close(fig)
+    return fig
+
+
 #################################################################
 # --- Session Component Management ---
 #################################################################
@@ -417,6 +1795,8 @@ def get_or_create_session_components(session_id, header_info_widget):
     step_input = pn.widgets.FloatInput(name="Step (V)", value=0.05, step=0.01, start=0.001, width=90); gate_input = pn.widgets.FloatInput(name="Gate V (V)", value=0.0, step=0.1, width=90)
     measure_button = pn.widgets.Button(name="Measure Selected Device", button_type="success", icon='settings-2', height=40)
     measure_all_button = pn.widgets.Button(name="Measure Full Array", button_type="primary", icon='grid', height=40, margin=(5,0,0,0))
+    cancel_scan_button = pn.widgets.Button(name="Cancel", button_type='danger', icon='player-stop', disabled=True, height=40, margin=(5,0,0,5))
+    screen_button = pn.widgets.Button(name="Screen Array (Pass/Fail)", button_type="default", icon='filter', height=40, margin=(5,0,0,0))
     measurement_status = pn.widgets.StaticText(value="", styles={'font-size':'9pt', 'margin-left':'5px'})
     compliance_input = pn.widgets.FloatInput(
         name="I Compliance (A)", value=0.001, # Default 1mA
@@ -427,24 +1807,28 @@ def get_or_create_session_components(session_id, header_info_widget):
     )
     
     last_sel_key = f'selector_last_sel_{session_id}'; pn.state.cache[last_sel_key] = [None]
+    pn.state.on_session_destroyed(lambda session_context: release_session_state(session_id)) # nothing of this session outlives it
+    scan_stop_event = threading.Event()
     callback_data = {'grid_cds': grid_cds, 'iv_cds': iv_cds, 'toggle': tap_enabled_toggle, 'info': selected_info, 'last_sel_tracker': pn.state.cache[last_sel_key], 'vmax': vmax_input, 'vmin': vmin_input, 'step': step_input, 'gate': gate_input, 'status': measurement_status, 'measure_all_button': measure_all_button,
                      'header_info': header_info_widget,'compliance': compliance_input}
 
     def handle_selection_change(attr, old, new):
         cb_grid_cds=callback_data['grid_cds']; cb_toggle=callback_data['toggle']; cb_info=callback_data['info']; cb_last_sel=callback_data['last_sel_tracker']; cb_status=callback_data['status']; cb_header_info=callback_data['header_info']
         if not cb_toggle.value: return
-        print(f"Selection changed (Callback): {old} -> {new}"); current_selection_index=None; new_colors=list(cb_grid_cds.data['color'])
-        if cb_last_sel[0] is not None and cb_last_sel[0]<len(new_colors): new_colors[cb_last_sel[0]]=DEFAULT_COLOR
+        print(f"Selection changed (Callback): {old} -> {new}"); current_selection_index=None; color_patches=[] # only the changed cells go to the browser
+        if cb_last_sel[0] is not None and cb_last_sel[0]<len(cb_grid_cds.data['color']): color_patches.append((cb_last_sel[0], DEFAULT_COLOR))
         if new:
             current_selection_index=new[0]; selected_id=cb_grid_cds.data['id'][current_selection_index]
             info_text=f"Sel: {selected_id}"; header_text=f"Selected: {selected_id}"; cb_info.value=info_text; cb_header_info.value=header_text
-            new_colors[current_selection_index]=SELECTED_COLOR; cb_last_sel[0]=current_selection_index; cb_status.value="Device selected. Click 'Measure'."
+            color_patches.append((current_selection_index, SELECTED_COLOR)); cb_last_sel[0]=current_selection_index; cb_status.value="Device selected. Click 'Measure'."
+            stored_iv=get_measurement_store().get('iv', cb_grid_cds.data['row'][current_selection_index], cb_grid_cds.data['col'][current_selection_index], current_iv_params())
+            if stored_iv is not None: callback_data['iv_cds'].data=stored_iv; cb_status.value=f"Showing stored I-V of {selected_id}. Click 'Measure' to re-measure."
         else:
             cb_info.value="Sel: None"; cb_header_info.value="Selected: None"
             cb_last_sel[0]=None; cb_status.value="No device selected."
-        cb_grid_cds.data['color']=new_colors
+        if color_patches: cb_grid_cds.patch({'color': color_patches})
 
-    def measure_single_device_callback(event):
+    async def measure_single_device_callback(event):
         print(f"Measure button clicked: {event}"); 
         cb_iv_cds=callback_data['iv_cds']; cb_last_sel=callback_data['last_sel_tracker']; 
         cb_grid_cds=callback_data['grid_cds']; cb_status=callback_data['status']; vmin=callback_data['vmin'].value; vmax=callback_data['vmax'].value; step=callback_data['step'].value; gate_v=callback_data['gate'].value; selected_index=cb_last_sel[0]
@@ -452,43 +1836,146 @@ def get_or_create_session_components(session_id, header_info_widget):
         # Pass compliance to simulation/hardware if needed
         if selected_index is None: print("Measurement Error: No device selected."); cb_status.value="Error: No device selected!"; return
         selected_row=cb_grid_cds.data['row'][selected_index]; selected_col=cb_grid_cds.data['col'][selected_index]; selected_id=cb_grid_cds.data['id'][selected_index]; cb_status.value=f"Measuring {selected_id}..."; 
-        iv_data=simulate_iv_curve(selected_row,selected_col,vmin,vmax,step,gate_v); 
-        cb_iv_cds.data=iv_data; cb_status.value=f"Measured {selected_id}."; 
+        backend=SCAN_BACKENDS[0]; loop=asyncio.get_running_loop()
+        # The plot is cleared once and then only gets the new points, streamed at about 10 Hz while the sweep runs
+        cb_iv_cds.data=dict(voltage=[], current=[]); streamer=ThrottledStreamer(pn.state.curdoc, cb_iv_cds)
+        if backend.startswith("SIM"):
+            # The simulation blocks, so it runs on the shared hardware pool while the event loop keeps serving other sessions
+            def _simulate():
+                curve=dict(voltage=[], current=[])
+                for chunk in simulate_iv_chunks(selected_row, selected_col, vmin, vmax, step, gate_v):
+                    streamer.push(chunk); curve['voltage']+=chunk['voltage']; curve['current']+=chunk['current']
+                return curve
+            iv_data=await loop.run_in_executor(get_hardware_executor(), _simulate)
+        else:
+            router=get_mux_router(backend)
+            try:
+                async with router.hold_async(selected_row, selected_col) if router is not None else nullcontext(): # routed until the sweep is read
+                    iv_data=await measure_iv_keithley_async(backend, vmin, vmax, step, compliance, device=(selected_row, selected_col), on_chunk=streamer.push) # awaits the buffer-full SRQ per chunk
+            except (pyvisa.errors.VisaIOError, TimeoutError, ValueError) as e: print(f"Measurement Error: {e}"); cb_status.value=f"Error measuring {selected_id}: {e}"; return
+        get_measurement_store().put('iv', selected_row, selected_col, iv_params(vmin, vmax, step, gate_v, compliance), iv_data, source=pn.state.curdoc)
+        archive_iv_curve(backend, selected_row, selected_col, iv_data, gate_v, compliance)
+        cb_status.value=f"Measured {selected_id}."; 
         print(f"Measurement complete for {selected_id}. Plot updated.")
 
     def update_toggle_color(event):
         toggle_widget=event.obj; is_on=event.new; toggle_widget.button_type='success' if is_on else 'warning'; toggle_widget.name="Active select ✔️" if is_on else "Inactive select ❌"; print(f"Toggle {'ON' if is_on else 'OFF'} - Color set to {toggle_widget.button_type}")
 
+    def cancel_scan_callback(event): scan_stop_event.set(); cancel_scan_button.disabled=True; callback_data['status'].value="Cancelling scan..."
+
     async def measure_full_array_callback(event):
         print(f"Measure Full Array button clicked: {event}"); cb_grid_cds=callback_data['grid_cds']; cb_status=callback_data['status']; cb_measure_all_button=callback_data['measure_all_button']
         if pn.state.curdoc is None: print("Error: No document context."); cb_status.value="Error: Cannot run scan (no session context)."; return
         compliance = callback_data['compliance'].value # Read compliance value
         print(f"--- Using Compliance for full scan: {compliance:.3e} A ---") # Log compliance
 
-        cb_measure_all_button.disabled=True; cb_measure_all_button.name="Measuring..."; cb_status.value="Starting full array scan..."; await asyncio.sleep(0.01); new_colors=[DEFAULT_COLOR]*(GRID_SIZE*GRID_SIZE); num_devices=GRID_SIZE*GRID_SIZE; measured_count=0; scan_error=None
+        scan_stop_event.clear(); cancel_scan_button.disabled=False
+        cb_measure_all_button.disabled=True; cb_measure_all_button.name="Measuring..."; cb_status.value=f"Starting full array scan on {len(SCAN_BACKENDS)} back-ends..."; await asyncio.sleep(0.01); num_devices=GRID_SIZE*GRID_SIZE; measured_count=0; scan_error=None
+        # Back-end workers push (idx, row, col, iv_data) into this queue from their threads; None marks the end of the scan
+        loop=asyncio.get_running_loop(); results=asyncio.Queue()
+        devices=[(idx, cb_grid_cds.data['row'][idx], cb_grid_cds.data['col'][idx]) for idx in range(num_devices)]
+        def _measure(backend, row, col):
+            iv_data=measure_iv(backend, row, col, FULL_SCAN_VMIN, FULL_SCAN_VMAX, FULL_SCAN_STEP, FULL_SCAN_GATE, compliance)
+            archive_iv_curve(backend, row, col, iv_data, FULL_SCAN_GATE, compliance); return iv_data
+        def _on_result(*item): loop.call_soon_threadsafe(results.put_nowait, item)
+        def _scan():
+            try: run_parallel_scan(devices, SCAN_BACKENDS, _measure, _on_result, stop_event=scan_stop_event)
+            finally: loop.call_soon_threadsafe(results.put_nowait, None)
+        doc=pn.state.curdoc; store=get_measurement_store(); scan_params=iv_params(FULL_SCAN_VMIN, FULL_SCAN_VMAX, FULL_SCAN_STEP, FULL_SCAN_GATE, compliance)
+        def _publish(conductances, colors):
+            # Other sessions get the same results through the store; this one patches its own grid
+            store.put_many('conductance', scan_params, {(row, col): {'conductance': float(g), 'color': c} for (_, row, col), g, c in zip(devices, conductances, colors)}, source=doc)
+        def _patch_colors(patches):
+            # Grid colours change through ColumnDataSource.patch: only the patched cells of the colour column are sent
+            try: cb_grid_cds.patch({'color': patches})
+            except Exception as e: print(f"Error patching grid colors: {e}"); cb_status.value="Error updating grid visuals."
         try:
-            for idx in range(num_devices):
-                row=cb_grid_cds.data['row'][idx]; col=cb_grid_cds.data['col'][idx]; 
-                # Pass compliance to simulation/hardware if needed
-                iv_data=simulate_iv_curve(row,col,FULL_SCAN_VMIN,FULL_SCAN_VMAX,FULL_SCAN_STEP,FULL_SCAN_GATE)
-                try: current_at_v=np.interp(CONDUCTANCE_VOLTAGE,iv_data['voltage'],iv_data['current']); conductance=0 if abs(CONDUCTANCE_VOLTAGE)<1e-9 else current_at_v/CONDUCTANCE_VOLTAGE
-                except Exception as e: print(f"Error calculating conductance for R{row}C{col}: {e}"); conductance=0
-                norm_g=np.clip((conductance-MIN_CONDUCTANCE)/(MAX_CONDUCTANCE-MIN_CONDUCTANCE),0,1); color_index=int(norm_g*(len(COLOR_PALETTE)-1)); new_colors[idx]=COLOR_PALETTE[color_index]; measured_count+=1
-                if measured_count%16==0: cb_status.value=f"Measuring... ({measured_count}/{num_devices})"; await asyncio.sleep(0)
-            print("Full scan simulation complete. Scheduling grid color update.")
-            def _apply_color_update(colors_to_apply):
-                print("Applying color update via next_tick");
-                try: current_data=dict(cb_grid_cds.data); current_data['color']=colors_to_apply; cb_grid_cds.data=current_data; print("Color update applied."); cb_status.value="Full array scan complete. Grid updated.";
-                except Exception as e: print(f"Error applying color update in next_tick: {e}"); cb_status.value="Error updating grid visuals."
-            pn.state.curdoc.add_next_tick_callback(lambda: _apply_color_update(new_colors)); cb_status.value="Scan complete. Updating grid..."
+            hardware_backends = [backend for backend in SCAN_BACKENDS if not backend.startswith("SIM")]
+            if TRIGGER_LINK_SCAN and hardware_backends and get_mux_router(hardware_backends[0]) is not None:
+                # Hardware-paced: one table upload and one buffer read per 256 devices, no per-device host round trips
+                cb_status.value="Running trigger-link scan..."
+                def _trigger_link_scan():
+                    currents = scan_array_trigger_link(hardware_backends[0], get_mux_router(hardware_backends[0]), [(d[1], d[2]) for d in devices], CONDUCTANCE_VOLTAGE, compliance, stop_event=scan_stop_event)
+                    return conductance_at_read_voltage([CONDUCTANCE_VOLTAGE], currents[:, None])
+                conductances=await loop.run_in_executor(get_hardware_executor(), _trigger_link_scan); measured_count=len(conductances)
+                new_colors=conductance_colors(conductances); devices=devices[:measured_count]; _publish(conductances, new_colors) # a cancelled scan stops after a whole route table
+                doc.add_next_tick_callback(functools.partial(_patch_colors, [(slice(0, measured_count), new_colors)]))
+            elif SIM_VECTORIZED_SCAN and all(backend.startswith("SIM") for backend in SCAN_BACKENDS):
+                # Virtual array: one (devices, points) simulation and one colour mapping pass for the whole grid
+                def _simulate_grid():
+                    voltage, currents = simulate_iv_array(cb_grid_cds.data['row'], cb_grid_cds.data['col'], FULL_SCAN_VMIN, FULL_SCAN_VMAX, FULL_SCAN_STEP, FULL_SCAN_GATE, seed=SIM_SEED)
+                    for (_, row, col), current in zip(devices, currents): archive_iv_curve("SIM", row, col, {'voltage': voltage, 'current': current}, FULL_SCAN_GATE, compliance)
+                    return conductance_at_read_voltage(voltage, currents)
+                conductances=await loop.run_in_executor(get_hardware_executor(), _simulate_grid); measured_count=num_devices
+                new_colors=conductance_colors(conductances); _publish(conductances, new_colors)
+                doc.add_next_tick_callback(functools.partial(_patch_colors, [(slice(0, num_devices), new_colors)]))
+            else:
+                await loop.run_in_executor(get_hardware_executor(), scan_backend_routers, SCAN_BACKENDS) # refuses hardware back-ends without a MUX controller of their own
+                scan_future=loop.run_in_executor(None, _scan)
+                scan_done=False
+                while not scan_done:
+                    # Every device that has finished since the last pass goes out in one patch
+                    batch=[await results.get()]
+                    while not results.empty(): batch.append(results.get_nowait())
+                    color_patches=[]; finished=[]
+                    for item in batch:
+                        if item is None: scan_done=True; continue
+                        idx, row, col, iv_data = item
+                        try: conductance=conductance_at_read_voltage(iv_data['voltage'], iv_data['current'])[0]
+                        except Exception as e: print(f"Error calculating conductance for R{row}C{col}: {e}"); conductance=0.0
+                        color=conductance_colors([conductance])[0]; color_patches.append((idx, color)); finished.append((idx, row, col, conductance, color)); measured_count+=1
+                        if measured_count%16==0: cb_status.value=f"Measuring... ({measured_count}/{num_devices})"
+                    if color_patches:
+                        doc.add_next_tick_callback(functools.partial(_patch_colors, color_patches))
+                        store.put_many('conductance', scan_params, {(row, col): {'conductance': float(g), 'color': c} for _, row, col, g, c in finished}, source=doc)
+                await scan_future # re-raises any back-end error
+            if scan_stop_event.is_set(): print("Full scan cancelled."); cb_status.value=f"Full array scan cancelled after {measured_count}/{num_devices} devices."
+            else: print("Full scan complete."); cb_status.value="Full array scan complete. Grid updated."
         except Exception as e: scan_error=e; cb_status.value=f"Error during scan: {e}"; print(f"Error during full array scan: {e}")
-        finally: cb_measure_all_button.disabled=False; cb_measure_all_button.name="Measure Full Array"; print("Button re-enabled.")
-
-    grid_cds.selected.on_change('indices',handle_selection_change); measure_button.on_click(measure_single_device_callback); tap_enabled_toggle.param.watch(update_toggle_color,'value'); measure_all_button.on_click(measure_full_array_callback)
+        finally: cb_measure_all_button.disabled=False; cb_measure_all_button.name="Measure Full Array"; cancel_scan_button.disabled=True; print("Button re-enabled.")
+
+    async def screen_array_callback(event):
+        print(f"Screen Array button clicked: {event}"); cb_grid_cds=callback_data['grid_cds']; cb_status=callback_data['status']
+        if pn.state.curdoc is None: cb_status.value="Error: Cannot run screen (no session context)."; return
+        compliance=callback_data['compliance'].value; doc=pn.state.curdoc; num_devices=GRID_SIZE*GRID_SIZE
+        rows=list(cb_grid_cds.data['row'][:num_devices]); cols=list(cb_grid_cds.data['col'][:num_devices])
+        screen_button.disabled=True; cb_status.value=f"Screening {num_devices} devices at {CONDUCTANCE_VOLTAGE} V..."
+        hardware_backends=[backend for backend in SCAN_BACKENDS if not backend.startswith("SIM")]
+        def _screen():
+            if hardware_backends: return screen_array_limits(hardware_backends[0], get_mux_router(hardware_backends[0]), list(zip(rows, cols)), compliance=compliance)
+            return screen_array_simulated(rows, cols, seed=SIM_SEED)
+        try:
+            bins=await asyncio.get_running_loop().run_in_executor(get_hardware_executor(), _screen); n_pass=int(np.sum(bins == SCREEN_PASS))
+            colors=[SCREEN_BIN_COLORS[int(b)] for b in bins]
+            def _apply_screen_colors():
+                cb_grid_cds.patch({'color': [(slice(0, num_devices), colors)]})
+                cb_status.value=f"Screen complete: {n_pass}/{num_devices} pass (green), low grey, high orange, compliance red."
+            doc.add_next_tick_callback(_apply_screen_colors)
+        except Exception as e: cb_status.value=f"Error during screen: {e}"; print(f"Error during array screen: {e}")
+        finally: screen_button.disabled=False
+
+    def current_iv_params(): return iv_params(vmin_input.value, vmax_input.value, step_input.value, gate_input.value, compliance_input.value)
+
+    def on_store_update(kind, array_id, params, items):
+        # Results another session stored for this array: conductances of the current full-scan setup are patched
+        # into the grid, an I-V curve replaces the plot if it is for the selected device and the current sweep setup
+        if array_id != ARRAY_ID: return
+        if kind == 'conductance' and params == iv_params(FULL_SCAN_VMIN, FULL_SCAN_VMAX, FULL_SCAN_STEP, FULL_SCAN_GATE, compliance_input.value):
+            grid_cds.patch({'color': [(row * GRID_SIZE + col, value['color']) for (row, col), value in items.items()]})
+        elif kind == 'iv' and params == current_iv_params() and pn.state.cache[last_sel_key][0] is not None:
+            selected = pn.state.cache[last_sel_key][0]; device = (grid_cds.data['row'][selected], grid_cds.data['col'][selected])
+            if device in items: iv_cds.data = items[device]; measurement_status.value = f"I-V of {grid_cds.data['id'][selected]} updated by another session."
+
+    store = get_measurement_store()
+    stored = store.results('conductance', iv_params(FULL_SCAN_VMIN, FULL_SCAN_VMAX, FULL_SCAN_STEP, FULL_SCAN_GATE, compliance_input.value))
+    if stored: grid_cds.patch({'color': [(row * GRID_SIZE + col, value['color']) for (row, col), value in stored.items()]}) # earlier scans are shown without re-measuring
+    if pn.state.curdoc is not None: store.subscribe(pn.state.curdoc, on_store_update)
+
+    grid_cds.selected.on_change('indices',handle_selection_change); measure_button.on_click(measure_single_device_callback); tap_enabled_toggle.param.watch(update_toggle_color,'value'); measure_all_button.on_click(measure_full_array_callback); cancel_scan_button.on_click(cancel_scan_callback); screen_button.on_click(screen_array_callback)
     session_components={'selector_pane':selector_pane,'iv_pane':iv_pane,'toggle':tap_enabled_toggle,
                         'info':selected_info,'vmax_input':vmax_input,'vmin_input':vmin_input,'step_input':step_input,
                         'gate_input':gate_input, 'compliance_input': compliance_input, 
-                        'measure_button':measure_button,'measurement_status':measurement_status,'measure_all_button':measure_all_button,'grid_cds':grid_cds}
+                        'measure_button':measure_button,'measurement_status':measurement_status,'measure_all_button':measure_all_button,'cancel_scan_button':cancel_scan_button,'screen_button':screen_button,'grid_cds':grid_cds}
     pn.state.cache[components_key]=session_components; return session_components
 
 #################################################################
@@ -496,27 +1983,34 @@ def get_or_create_session_components(session_id, header_info_widget):
 #################################################################
 def page_home(): return pn.Column(pn.pane.Markdown("## Home"), pn.pane.Markdown("Welcome!"))
 
+def page_memory():
+    """Memory report of the server process, with a manual purge of expired entries."""
+    report_pane = pn.pane.JSON(memory_report(), depth=2, sizing_mode="stretch_width")
+    refresh_button = pn.widgets.Button(name="Refresh", button_type='primary', icon='refresh')
+    purge_button = pn.widgets.Button(name="Purge Expired Entries", button_type='warning', icon='trash')
+    def refresh(event=None): report_pane.object = memory_report()
+    def purge(event): purge_expired_caches(); refresh()
+    refresh_button.on_click(refresh); purge_button.on_click(purge)
+    return pn.Column(pn.pane.Markdown("## Server Memory"), pn.Row(refresh_button, purge_button), report_pane, sizing_mode="stretch_width")
+
 
 
 # --- NEW Settings Page Function (Improved Layout) ---
 def page_settings():
     """Creates the UI layout for the Keithley 2400 Settings page."""
     print("Rendering page_settings")
-    global RESOURCE_MANAGER
-    RESOURCE_MANAGER = None 
-    
-    # Initialize VISA Resource Manager if not already done
-    if RESOURCE_MANAGER is None:
-        try:
-            RESOURCE_MANAGER = pyvisa.ResourceManager()
-            print("VISA Resource Manager initialized.")
-        except Exception as e:
-            print(f"FATAL: Could not initialize VISA Resource Manager: {e}")
-            # Display error clearly if VISA fails
-            return pn.Column(
-                 pn.pane.Markdown("## Keithley 2400 Settings"),
-                 pn.pane.Alert(f"Error initializing VISA library: {e}. Please ensure VISA is installed and configured correctly.", alert_type="danger")
-            )
+    pool = get_instrument_pool()
+
+    # The VISA Resource Manager is created once and shared through the pool
+    try:
+        pool.resource_manager()
+    except Exception as e:
+        print(f"FATAL: Could not initialize VISA Resource Manager: {e}")
+        # Display error clearly if VISA fails
+        return pn.Column(
+             pn.pane.Markdown("## Keithley 2400 Settings"),
+             pn.pane.Alert(f"Error initializing VISA library: {e}. Please ensure VISA is installed and configured correctly.", alert_type="danger")
+        )
 
 
     # --- Create Widgets for Settings ---
@@ -554,64 +2048,68 @@ def page_settings():
     status_text = pn.widgets.StaticText(value="Connect and Read Settings.", height=40, margin=(5,5)) # Initial message
 
     # --- Helper Function to Safely Interact with Instrument ---
+    def _talk(instrument, action_type, command):
+        # Blocking VISA I/O, run on the hardware executor
+        if action_type == "query":
+            if command: return instrument.query(command).strip()
+            else: return None
+        elif action_type == "write":
+            if command:
+                invalidate_cached_settings(KEITHLEY_ADDRESS) # any write may change what the snapshot says
+                instrument.write(command); error = instrument.query(":SYST:ERR:ALL?")
+                if 'No error' in error: return True, None
+                else: return False, error.strip()
+            else: return True, None
+        else: return None
+
     async def _instrument_action(action_type="query", command=None):
-        # (Keep this helper function exactly the same as before)
-        instrument = None; status_text.value = f"Connecting to {KEITHLEY_ADDRESS}..."; await asyncio.sleep(0.01)
+        # Borrows the pooled session for KEITHLEY_ADDRESS instead of opening a new one per command.
+        # Waiting for the lease and the I/O itself both happen off the event loop, so a long
+        # measurement holding the instrument does not freeze the other sessions.
+        status_text.value = f"Talking to {KEITHLEY_ADDRESS}..."; await asyncio.sleep(0.01)
         try:
-            instrument = RESOURCE_MANAGER.open_resource(KEITHLEY_ADDRESS); instrument.timeout = 5000; instrument.write_termination = '\n'; instrument.read_termination = '\n'; instrument.write("*CLS")
-            if action_type == "query":
-                if command: response = instrument.query(command); instrument.close(); return response.strip()
-                else: instrument.close(); return None
-            elif action_type == "write":
-                if command:
-                    instrument.write(command); error = instrument.query(":SYST:ERR?"); instrument.close()
-                    if 'No error' in error: return True, None
-                    else: return False, error.strip()
-                else: instrument.close(); return True, None
-            else: instrument.close(); return None
-        except pyvisa.errors.VisaIOError as e: status_text.value = f"VISA Error: {e}"; print(f"VISA Error communicating with {KEITHLEY_ADDRESS}: {e}"); instrument and instrument.close(); return None if action_type=="query" else (False, str(e))
-        except Exception as e: status_text.value = f"General Error: {e}"; print(f"Unexpected Error: {e}\n{traceback.format_exc()}"); instrument and instrument.close(); return None if action_type=="query" else (False, str(e))
+            async with pool.lease_async(KEITHLEY_ADDRESS) as instrument:
+                return await asyncio.get_running_loop().run_in_executor(get_hardware_executor(), _talk, instrument, action_type, command)
+        except pyvisa.errors.VisaIOError as e: status_text.value = f"VISA Error: {e}"; print(f"VISA Error communicating with {KEITHLEY_ADDRESS}: {e}"); return None if action_type=="query" else (False, str(e))
+        except Exception as e: status_text.value = f"General Error: {e}"; print(f"Unexpected Error: {e}\n{traceback.format_exc()}"); return None if action_type=="query" else (False, str(e))
 
 
     # --- Callback to Read Settings (Modified to update compliance name) ---
     async def read_instrument_settings(event):
         print("Reading instrument settings...")
         read_button.loading = True; status_text.value = "Reading settings..."
-        results = {}; commands = {'idn':'*IDN?', 'source_func':':SOUR:FUNC?', 'sense_mode':':SYST:RSEN?', 'compliance_curr':':SENS:CURR:PROT?', 'compliance_volt':':SENS:VOLT:PROT?', 'nplc_curr':':SENS:CURR:NPLC?', 'nplc_volt':':SENS:VOLT:NPLC?', 'output_state':':OUTP:STAT?', 'terminals':':ROUT:TERM?'}
-        idn = await _instrument_action("query", commands['idn'])
-        if idn is None: status_text.value += " (Failed to get IDN)"; read_button.loading=False; return
-        status_text.value = f"Connected to: {idn}"; await asyncio.sleep(0.1)
-        read_ok = True
-        for key, cmd in commands.items():
-            if key == 'idn': continue
-            response = await _instrument_action("query", cmd)
-            if response is None: status_text.value += f"\nError reading {key}!"; read_ok = False; break
-            results[key] = response; await asyncio.sleep(0.05)
-        if not read_ok: read_button.loading=False; return
+        # One compound query for all settings, served from cache if another page read them moments ago
+        settings = get_cached_settings(KEITHLEY_ADDRESS)
+        if settings is None:
+            reply = await _instrument_action("query", SETTINGS_SNAPSHOT_QUERY)
+            if reply is None: status_text.value += " (Failed to read settings)"; read_button.loading=False; return
+            try: settings = InstrumentSettings.from_reply(reply)
+            except ValueError as e: status_text.value = f"Error parsing settings: {e}"; read_button.loading=False; return
+            cache_settings(KEITHLEY_ADDRESS, settings)
+        status_text.value = f"Connected to: {settings.idn}"
         # Update widgets based on read results
         try:
             # --- Update Source Func FIRST ---
-            read_source_func = results.get('source_func', 'VOLT')
+            read_source_func = settings.source_func
             setting_source_func.value = read_source_func
 
             # --- Update Compliance Name and Value ---
             if read_source_func == 'VOLT':
                 setting_compliance_val.name = "I Compliance (A)" # Update name
-                setting_compliance_val.value = float(results.get('compliance_curr', 0.001))
-                setting_nplc.value = float(results.get('nplc_volt', 1))
+                setting_compliance_val.value = settings.compliance_curr
+                setting_nplc.value = settings.nplc_volt
             else: # Sourcing Current
                 setting_compliance_val.name = "V Compliance (V)" # Update name
-                setting_compliance_val.value = float(results.get('compliance_volt', 20.0))
-                setting_nplc.value = float(results.get('nplc_curr', 1))
+                setting_compliance_val.value = settings.compliance_volt
+                setting_nplc.value = settings.nplc_curr
             # --- End Compliance Update ---
 
-            setting_sense_mode.value = '4-Wire' if int(results.get('sense_mode', 0)) == 1 else '2-Wire'
-            is_on = (int(results.get('output_state', 0)) == 1)
+            setting_sense_mode.value = '4-Wire' if settings.four_wire else '2-Wire'
+            is_on = settings.output_on
             setting_output_state.value = is_on # Update toggle state FIRST
             setting_output_state.name = "Output ON" if is_on else "Output OFF" # Then update name
             setting_output_state.button_type = 'success' if is_on else 'danger' # Then update color
-            term_val = results.get('terminals', 'FRON')
-            setting_terminals.value = 'Front' if term_val == 'FRON' else 'Rear'
+            setting_terminals.value = 'Front' if settings.terminals == 'FRON' else 'Rear'
             status_text.value += "\nSettings read successfully."
         except Exception as e: status_text.value += f"\nError parsing settings: {e}"; print(f"Error updating widgets from instrument read: {e}")
         read_button.loading = False
@@ -631,13 +2129,11 @@ def page_settings():
         rsen_cmd = "ON" if setting_sense_mode.value == '4-Wire' else "OFF"; commands_to_write.append(f":SYST:RSEN {rsen_cmd}")
         term_cmd = "FRON" if setting_terminals.value == 'Front' else "REAR"; commands_to_write.append(f":ROUT:TERM {term_cmd}")
         out_cmd = "ON" if setting_output_state.value else "OFF"; commands_to_write.append(f":OUTP:STAT {out_cmd}")
-        all_ok = True; final_msg = ""
-        for cmd in commands_to_write:
-            status_text.value = f"Sending: {cmd}"; success, error_msg = await _instrument_action("write", cmd)
-            if not success: final_msg = f"Error applying '{cmd}': {error_msg}"; all_ok = False; break
-            await asyncio.sleep(0.05)
-        if all_ok: status_text.value = "Settings applied successfully."
-        else: status_text.value = final_msg
+        # Send everything as one ';'-joined write; _instrument_action then reads the whole error queue once
+        batch_cmd = ";".join(commands_to_write)
+        status_text.value = f"Sending {len(commands_to_write)} commands..."; success, error_msg = await _instrument_action("write", batch_cmd)
+        if success: status_text.value = "Settings applied successfully."
+        else: status_text.value = f"Error applying settings: {error_msg}"
         is_on = setting_output_state.value; setting_output_state.name = "Output ON" if is_on else "Output OFF"; setting_output_state.button_type = 'success' if is_on else 'danger'
         apply_button.loading = False
 
@@ -721,6 +2217,11 @@ def page_ispp_tuning(session_components, header_info_widget):
     run_ispp_button = pn.widgets.Button(name="Run ISPP Tune on Selected Device", button_type='primary', icon='player-play')
     ispp_status_text = pn.widgets.StaticText(value="Select device via sidebar grid first.", height=40, margin=(5,5))
     ispp_plot_pane = pn.pane.Matplotlib(None, sizing_mode="stretch_width", height=450)
+    cancel_ispp_button = pn.widgets.Button(name="Cancel", button_type='danger', icon='player-stop', disabled=True)
+    target_map_input = pn.widgets.FileInput(accept='.csv,.txt', name="Target map")
+    run_batch_button = pn.widgets.Button(name="Run Batch ISPP on Array", button_type='primary', icon='grid', disabled=not SCAN_BACKENDS[0].startswith("SIM") and SCAN_MUX_PORTS.get(SCAN_BACKENDS[0], MUX_PORT) is None)
+    ispp_stop_event = threading.Event()
+    def cancel_ispp_callback(event): ispp_stop_event.set(); cancel_ispp_button.disabled=True; ispp_status_text.value="Cancelling ISPP..."
     async def run_ispp_callback(event):
         print("Run ISPP button clicked")
         if pn.state.curdoc is None or pn.state.curdoc.session_context is None: ispp_status_text.value="Error: Session context lost."; return
@@ -733,16 +2234,61 @@ def page_ispp_tuning(session_components, header_info_widget):
         if not grid_cds: ispp_status_text.value = "Error: Grid data source not found in session."; ispp_plot_pane.object = None; return
         selected_index = last_sel_tracker[0]; row=grid_cds.data['row'][selected_index]; col=grid_cds.data['col'][selected_index]; device_id=grid_cds.data['id'][selected_index]
         target_r=target_r_input.value; tolerance=tolerance_input.value; run_ispp_button.disabled=True; run_ispp_button.name="Running ISPP..."; ispp_status_text.value=f"Running ISPP for {device_id}..."; ispp_plot_pane.object=None; await asyncio.sleep(0.01)
+        doc = pn.state.curdoc; ispp_stop_event.clear(); cancel_ispp_button.disabled=False
+        def _post_progress(iteration, max_iterations, resistance):
+            # Called from the worker thread; widget updates go back through the document's next tick
+            r_text = f"{resistance:.2f} Ohms" if resistance is not None else "N/A"
+            def _update(): ispp_status_text.value = f"Running ISPP for {device_id}... iteration {iteration}/{max_iterations}, R = {r_text}"
+            doc.add_next_tick_callback(_update)
         try:
-            success, final_r, history = ispp_tune_resistance_adaptive(row=row, col=col, target_resistance=target_r, tolerance=tolerance, max_iterations=100)
+            backend = SCAN_BACKENDS[0]; router = None
+            if backend.startswith("SIM"): tune = functools.partial(ispp_tune_resistance_adaptive, row=row, col=col, target_resistance=target_r, tolerance=tolerance, max_iterations=100, progress_callback=_post_progress, stop_event=ispp_stop_event)
+            else:
+                # Hardware: the pulse/read loop runs from the 2400's source memory, one burst per polarity
+                router = get_mux_router(backend)
+                tune = functools.partial(ispp_tune_resistance_memory_sweep, backend, row, col, target_resistance=target_r, tolerance=tolerance, max_iterations=100, compliance=current_session_components['compliance'].value, progress_callback=_post_progress, stop_event=ispp_stop_event)
+            async with router.hold_async(row, col) if router is not None else nullcontext(): # routed until tuning ends
+                success, final_r, history = await asyncio.get_running_loop().run_in_executor(get_hardware_executor(), tune)
+            get_measurement_store().put('ispp', row, col, (float(target_r), float(tolerance)), {'success': success, 'final_resistance': final_r, 'history': history}, source=doc)
             if history: ispp_plot_pane.object = plot_ispp_history(history, target_r, tolerance, row, col)
             else: ispp_plot_pane.object = None
-            if success: ispp_status_text.value = f"ISPP Complete for {device_id}: Success! Final R = {final_r:.2f} Ohms"
+            if ispp_stop_event.is_set(): ispp_status_text.value = f"ISPP cancelled for {device_id}."
+            elif success: ispp_status_text.value = f"ISPP Complete for {device_id}: Success! Final R = {final_r:.2f} Ohms"
             else: ispp_status_text.value = f"ISPP Complete for {device_id}: Failed. Final R = {final_r:.2f} Ohms"
         except Exception as e: ispp_status_text.value=f"ISPP Error for {device_id}: {e}"; ispp_plot_pane.object=None; print(f"Error during ISPP call: {e}")
-        finally: run_ispp_button.disabled=False; run_ispp_button.name="Run ISPP Tune on Selected Device"
-    run_ispp_button.on_click(run_ispp_callback)
-    ispp_page_layout = pn.Column(pn.pane.Markdown("## ISPP Resistance Tuning"), pn.Row(target_r_input, tolerance_input), run_ispp_button, ispp_status_text, pn.layout.Divider(), ispp_plot_pane, sizing_mode="stretch_width")
+        finally: run_ispp_button.disabled=False; run_ispp_button.name="Run ISPP Tune on Selected Device"; cancel_ispp_button.disabled=True
+    async def run_batch_ispp_callback(event):
+        print("Run Batch ISPP button clicked")
+        if pn.state.curdoc is None or pn.state.curdoc.session_context is None: ispp_status_text.value="Error: Session context lost."; return
+        if not SCAN_BACKENDS[0].startswith("SIM") and get_mux_router(SCAN_BACKENDS[0]) is None: ispp_status_text.value="Error: Batch ISPP on hardware needs a MUX controller (MUX_PORT or SCAN_MUX_PORTS)."; return
+        # Target map: GRID_SIZE x GRID_SIZE comma separated resistances (NaN = skip), else the target R for every device
+        if target_map_input.value:
+            try: targets = np.loadtxt(target_map_input.value.decode().splitlines(), delimiter=',', ndmin=2)
+            except ValueError as e: ispp_status_text.value=f"Error reading target map: {e}"; return
+            if targets.shape != (GRID_SIZE, GRID_SIZE): ispp_status_text.value=f"Error: Target map must be {GRID_SIZE}x{GRID_SIZE}, got {targets.shape[0]}x{targets.shape[1]}."; return
+        else: targets = np.full((GRID_SIZE, GRID_SIZE), float(target_r_input.value))
+        tolerance=tolerance_input.value; doc = pn.state.curdoc; ispp_stop_event.clear()
+        run_batch_button.disabled=True; run_ispp_button.disabled=True; cancel_ispp_button.disabled=False; ispp_status_text.value="Running batch ISPP..."; ispp_plot_pane.object=None
+        def _post_progress(round_index, max_iterations, active, converged):
+            def _update(): ispp_status_text.value = f"Batch ISPP round {round_index}/{max_iterations}: {converged} converged, {active} still tuning"
+            doc.add_next_tick_callback(_update)
+        try:
+            backend = SCAN_BACKENDS[0]
+            if backend.startswith("SIM"): tune = functools.partial(ispp_tune_array_adaptive, targets, tolerance=tolerance, max_iterations=100, progress_callback=_post_progress, stop_event=ispp_stop_event)
+            else: # hardware: one route and one source-memory burst per device and round
+                compliance = get_or_create_session_components(doc.session_context.id, header_info_widget)['compliance'].value
+                tune = functools.partial(ispp_tune_array_memory_sweep, backend, targets, tolerance=tolerance, max_iterations=100, compliance=compliance, progress_callback=_post_progress, stop_event=ispp_stop_event)
+            results = await asyncio.get_running_loop().run_in_executor(get_hardware_executor(), tune)
+            by_params = {}
+            for (r, c), result in results.items(): by_params.setdefault((float(targets[r, c]), float(tolerance)), {})[(int(r), int(c))] = result
+            for params, items in by_params.items(): get_measurement_store().put_many('ispp', params, items, source=doc)
+            ispp_plot_pane.object = plot_batch_ispp_result(results)
+            n_ok = sum(r['success'] for r in results.values())
+            ispp_status_text.value = f"Batch ISPP {'cancelled' if ispp_stop_event.is_set() else 'complete'}: {n_ok}/{len(results)} devices converged."
+        except Exception as e: ispp_status_text.value=f"Batch ISPP Error: {e}"; ispp_plot_pane.object=None; print(f"Error during batch ISPP: {e}")
+        finally: run_batch_button.disabled=False; run_ispp_button.disabled=False; cancel_ispp_button.disabled=True
+    run_ispp_button.on_click(run_ispp_callback); cancel_ispp_button.on_click(cancel_ispp_callback); run_batch_button.on_click(run_batch_ispp_callback)
+    ispp_page_layout = pn.Column(pn.pane.Markdown("## ISPP Resistance Tuning"), pn.Row(target_r_input, tolerance_input), pn.Row(run_ispp_button, cancel_ispp_button), pn.Row(run_batch_button, target_map_input), ispp_status_text, pn.layout.Divider(), ispp_plot_pane, sizing_mode="stretch_width")
     return ispp_page_layout
 
 
@@ -757,6 +2303,7 @@ def get_page_content(url_hash, header_info_widget):
     if page_route == "selector": return page_selector_main(session_components)
     elif page_route == "ispp_tuning": return page_ispp_tuning(session_components, header_info_widget)
     elif page_route == "settings": return page_settings()
+    elif page_route == "memory": return page_memory()
     else: return page_home()
 
 
@@ -781,7 +2328,8 @@ def get_sidebar_measurement_controls(url_hash, session_components):
             pn.Row(session_components['step_input'], session_components['gate_input']), 
             session_components['compliance_input'],
             session_components['measure_button'], 
-            session_components['measure_all_button'], 
+            pn.Row(session_components['measure_all_button'], session_components['cancel_scan_button']), 
+            session_components['screen_button'], 
             session_components['measurement_status'], 
             sizing_mode='stretch_width')
     else: return None
@@ -818,6 +2366,7 @@ def create_app():
         {"name": "Measurement", "hash": "#selector"},
         {"name": "ISPP Tuning", "hash": "#ispp_tuning"},
         {"name": "Settings", "hash": "#settings"},
+        {"name": "Memory", "hash": "#memory"},
     ]
 
     # 2. Function to generate navigation Markdown dynamically
@@ -23,6 +23,59 @@ const int DATA_PIN_MUX_TE = 12;  // Example: D12
 const int CLOCK_PIN_MUX_TE = 13; // Example: D13
 const int LATCH_PIN_MUX_TE = A0; // Example: A0 (Analog pins can be used as digital)
 
+// Scan trigger input: a falling edge (e.g. the Keithley 2400 Trigger Link output) steps the route table
+const int TRIGGER_IN_PIN = 2; // D2 (INT4 on the Mega)
+// "Route settled" output: a low-going pulse after each route table step, wired to a Keithley 2400
+// Trigger Link input line so the SMU measures as soon as the new device is connected
+const int SETTLED_OUT_PIN = 22; // D22
+const unsigned int ROUTE_SETTLE_US = 100; // MUX settling time before the settled pulse
+const unsigned int SETTLED_PULSE_US = 20; // the 2400 needs a trigger pulse of at least 10 us
+
+// --- Serial Settings ---
+const long SERIAL_BAUD = 115200;
+
+// --- Binary Frame Mode ---
+// A frame is FRAME_LENGTH bytes: [FRAME_SYNC][group id][word high][word low][sequence][CRC-8]
+// The CRC-8 (polynomial 0x07, init 0x00) covers everything between the sync byte and the CRC.
+// The reply is a single byte: ACK when the word was latched, NAK otherwise.
+// FRAME_SYNC is not a printable character, so text commands keep working for debugging.
+const byte FRAME_SYNC = 0xA5;
+const byte FRAME_LENGTH = 6;
+const byte ACK = 0x06;
+const byte NAK = 0x15;
+const byte GROUP_MUX_BE12 = 1;
+const byte GROUP_MUX_BE34 = 2;
+const byte GROUP_ENABLE = 3;
+const byte GROUP_MUX_TE = 4;
+// ROUTE frames latch all four groups at once:
+// [FRAME_SYNC][GROUP_ROUTE][BE12 high][BE12 low][BE34 high][BE34 low][ENABLE high][ENABLE low][MUX_TE][sequence][CRC-8]
+const byte GROUP_ROUTE = 5;
+const byte ROUTE_FRAME_LENGTH = 11;
+
+// Route table frames: GROUP_TABLE_APPEND has the ROUTE layout and stores the route as the next table
+// entry instead of latching it. GROUP_TABLE_CONTROL has the single-group layout, its word is a TABLE_* command.
+const byte GROUP_TABLE_APPEND = 6;
+const byte GROUP_TABLE_CONTROL = 7;
+const uint16_t TABLE_CLEAR = 0; // empty the table
+const uint16_t TABLE_ARM = 1;   // latch entry 0; every trigger (or NEXT_BYTE) then latches the next entry
+// A lone NEXT_BYTE steps the armed table by one entry; the reply is ACK, or NAK past the last entry.
+const byte NEXT_BYTE = 0xA6;
+
+int lastFrameSequence = -1; // sequence of the last latched frame, repeats are ACKed without re-latching
+
+// --- Route Table ---
+struct RouteEntry {
+  uint16_t be12;
+  uint16_t be34;
+  uint16_t enable;
+  byte te;
+};
+const int MAX_ROUTE_TABLE = 256; // a whole 16x16 array, 7 bytes per entry
+RouteEntry routeTable[MAX_ROUTE_TABLE];
+int routeTableLength = 0;
+int routeTableIndex = -1; // entry currently latched, -1 while not armed
+volatile int pendingTriggers = 0; // counted in onTriggerIn(), consumed in loop()
+
 /*
    General Wiring Notes for each 74LS595 chain:
    - DATA_PIN_GROUP -> SER (DS, pin 14) of the FIRST 74LS595 in that group.
@@ -65,7 +118,12 @@ void setup() {
   pinMode(CLOCK_PIN_MUX_TE, OUTPUT);
   pinMode(LATCH_PIN_MUX_TE, OUTPUT);
 
-  Serial.begin(9600);
+  pinMode(SETTLED_OUT_PIN, OUTPUT);
+  digitalWrite(SETTLED_OUT_PIN, HIGH); // idle high, Trigger Link is active low
+  pinMode(TRIGGER_IN_PIN, INPUT_PULLUP);
+  attachInterrupt(digitalPinToInterrupt(TRIGGER_IN_PIN), onTriggerIn, FALLING);
+
+  Serial.begin(SERIAL_BAUD);
   while (!Serial) {
     ; // wait for serial port to connect.
   }
@@ -82,7 +140,18 @@ void setup() {
 }
 
 void loop() {
-  if (Serial.available() > 0) {
+  if (pendingTriggers > 0) {
+    noInterrupts();
+    pendingTriggers--;
+    interrupts();
+    stepRouteTable();
+  }
+  if (Serial.available() > 0 && Serial.peek() == NEXT_BYTE) {
+    Serial.read();
+    Serial.write(stepRouteTable() ? ACK : NAK);
+  } else if (Serial.available() > 0 && Serial.peek() == FRAME_SYNC) {
+    handleBinaryFrame();
+  } else if (Serial.available() > 0) {
     String inputString = Serial.readStringUntil('\n');
     inputString.trim();
 
@@ -99,6 +168,12 @@ void loop() {
     } else if (inputString.startsWith("ENABLE ")) {
       String value = inputString.substring(String("ENABLE ").length());
       parseEnableValue(value, DATA_PIN_ENABLE, CLOCK_PIN_ENABLE, LATCH_PIN_ENABLE);
+    } else if (inputString.startsWith("ROUTE ")) {
+      String value = inputString.substring(String("ROUTE ").length());
+      parseRouteValues(value);
+    } else if (inputString.startsWith("TABLE ")) {
+      String value = inputString.substring(String("TABLE ").length());
+      parseTableCommand(value);
     } else if (inputString.startsWith("muxTE ")) {
       String value = inputString.substring(String("muxTE ").length());
       parseMux2Value(value, DATA_PIN_MUX_TE, CLOCK_PIN_MUX_TE, LATCH_PIN_MUX_TE, "MUX_TE");
@@ -117,22 +192,223 @@ void printGeneralUsage() {
   Serial.println("muxBE34 VALUE     (e.g., muxBE34 255)");
   Serial.println("ENABLE VALUE      (e.g., ENABLE 0xFFFF or 65535 or 0b1010...)");
   Serial.println("muxTE VALUE       (e.g., muxTE 0xAB or 0b10101011 or 171)");
+  Serial.println("ROUTE BE12 BE34 ENABLE TE  (e.g., ROUTE 0x1111 0x0 0x1 0x5) latches all groups together");
+  Serial.println("TABLE ADD BE12 BE34 ENABLE TE | TABLE CLEAR | TABLE ARM | TABLE NEXT | TABLE STATUS");
   Serial.println("VALUE can be decimal, 0xHEX, or 0bBINARY.");
   Serial.println("For muxBE12/34, VALUE is 16-bit. For muxTE, VALUE is 8-bit.");
   Serial.println("--------------------------");
 }
 
+/**
+ * @brief CRC-8 (polynomial 0x07, init 0x00) used by the binary frames.
+ */
+byte crc8(const byte* data, byte length) {
+  byte crc = 0x00;
+  for (byte i = 0; i < length; i++) {
+    crc ^= data[i];
+    for (byte bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (byte)((crc << 1) ^ 0x07) : (byte)(crc << 1);
+    }
+  }
+  return crc;
+}
+
+/**
+ * @brief Latches a word into one group. Returns false for an unknown group or a MUX_TE word over 8 bits.
+ */
+bool applyGroupWord(byte group, uint16_t data) {
+  switch (group) {
+    case GROUP_MUX_BE12: write16BitsToChain(DATA_PIN_MUX_BE12, CLOCK_PIN_MUX_BE12, LATCH_PIN_MUX_BE12, data); return true;
+    case GROUP_MUX_BE34: write16BitsToChain(DATA_PIN_MUX_BE34, CLOCK_PIN_MUX_BE34, LATCH_PIN_MUX_BE34, data); return true;
+    case GROUP_ENABLE:   write16BitsToChain(DATA_PIN_ENABLE, CLOCK_PIN_ENABLE, LATCH_PIN_ENABLE, data); return true;
+    case GROUP_MUX_TE:
+      if (data > 0xFF) return false;
+      write8BitsToChain(DATA_PIN_MUX_TE, CLOCK_PIN_MUX_TE, LATCH_PIN_MUX_TE, (byte)data);
+      return true;
+    default: return false;
+  }
+}
+
+/**
+ * @brief Reads one binary frame (see FRAME_SYNC and GROUP_ROUTE) and answers with a single ACK or NAK byte.
+ */
+void handleBinaryFrame() {
+  byte frame[ROUTE_FRAME_LENGTH];
+  if (Serial.readBytes(frame, 2) != 2) { Serial.write(NAK); return; }
+  byte length = (frame[1] == GROUP_ROUTE || frame[1] == GROUP_TABLE_APPEND) ? ROUTE_FRAME_LENGTH : FRAME_LENGTH;
+  if (Serial.readBytes(frame + 2, length - 2) != (size_t)(length - 2) || crc8(frame + 1, length - 2) != frame[length - 1]) {
+    Serial.write(NAK);
+    return;
+  }
+  byte sequence = frame[length - 2];
+  if (sequence == lastFrameSequence) { Serial.write(ACK); return; } // host retry of a frame we already latched
+  bool ok = true;
+  if (frame[1] == GROUP_ROUTE) {
+    applyRoute(((uint16_t)frame[2] << 8) | frame[3], ((uint16_t)frame[4] << 8) | frame[5], ((uint16_t)frame[6] << 8) | frame[7], frame[8]);
+  } else if (frame[1] == GROUP_TABLE_APPEND) {
+    RouteEntry entry = { (uint16_t)((frame[2] << 8) | frame[3]), (uint16_t)((frame[4] << 8) | frame[5]), (uint16_t)((frame[6] << 8) | frame[7]), frame[8] };
+    ok = appendRouteTable(entry);
+  } else if (frame[1] == GROUP_TABLE_CONTROL) {
+    ok = controlRouteTable(((uint16_t)frame[2] << 8) | frame[3]);
+  } else {
+    ok = applyGroupWord(frame[1], ((uint16_t)frame[2] << 8) | frame[3]);
+  }
+  if (!ok) { Serial.write(NAK); return; }
+  lastFrameSequence = sequence;
+  Serial.write(ACK);
+}
+
+/**
+ * @brief Break before make: latches ENABLE = 0 first, so no line is enabled while the muxes change,
+ * then shifts and latches BE12, BE34 and TE, and latches the new ENABLE word last. The latch pins
+ * sit on different ports and rise microseconds apart, so only ENABLE going last keeps the array
+ * from ever seeing a new enable line with an old mux selection.
+ */
+void applyRoute(uint16_t be12, uint16_t be34, uint16_t enable, byte te) {
+  write16BitsToChain(DATA_PIN_ENABLE, CLOCK_PIN_ENABLE, LATCH_PIN_ENABLE, 0x0000);
+  digitalWrite(LATCH_PIN_MUX_BE12, LOW);
+  digitalWrite(LATCH_PIN_MUX_BE34, LOW);
+  digitalWrite(LATCH_PIN_MUX_TE, LOW);
+  shift16Bits(DATA_PIN_MUX_BE12, CLOCK_PIN_MUX_BE12, be12);
+  shift16Bits(DATA_PIN_MUX_BE34, CLOCK_PIN_MUX_BE34, be34);
+  shiftOut(DATA_PIN_MUX_TE, CLOCK_PIN_MUX_TE, MSBFIRST, te);
+  digitalWrite(LATCH_PIN_MUX_BE12, HIGH);
+  digitalWrite(LATCH_PIN_MUX_BE34, HIGH);
+  digitalWrite(LATCH_PIN_MUX_TE, HIGH);
+  write16BitsToChain(DATA_PIN_ENABLE, CLOCK_PIN_ENABLE, LATCH_PIN_ENABLE, enable);
+}
+
+/**
+ * @brief Parses "BE12 BE34 ENABLE TE" (decimal or 0xHEX values) into entry. Prints an error and returns false if invalid.
+ */
+bool parseRouteWords(String valueInput, RouteEntry& entry) {
+  valueInput.trim();
+  unsigned long values[4];
+  const char* cursor = valueInput.c_str();
+  char* end;
+  for (int i = 0; i < 4; i++) {
+    values[i] = strtoul(cursor, &end, 0);
+    if (end == cursor || values[i] > (i == 3 ? 0xFFUL : 0xFFFFUL)) {
+      Serial.println("Error (ROUTE): Expected four values: BE12 BE34 ENABLE (16-bit) and TE (8-bit).");
+      printGeneralUsage();
+      return false;
+    }
+    cursor = end;
+  }
+  entry.be12 = (uint16_t)values[0]; entry.be34 = (uint16_t)values[1]; entry.enable = (uint16_t)values[2]; entry.te = (byte)values[3];
+  return true;
+}
+
+/**
+ * @brief Parses "ROUTE BE12 BE34 ENABLE TE" and applies it with applyRoute().
+ */
+void parseRouteValues(String valueInput) {
+  RouteEntry entry;
+  if (!parseRouteWords(valueInput, entry)) return;
+  applyRoute(entry.be12, entry.be34, entry.enable, entry.te);
+  char hexString[32]; sprintf(hexString, "%04X %04X %04X %02X", entry.be12, entry.be34, entry.enable, entry.te);
+  Serial.print("ROUTE latched (BE12 BE34 ENABLE TE): "); Serial.println(hexString);
+  printGeneralUsage();
+}
+
+/**
+ * @brief Trigger input interrupt: only counts the edge, loop() does the shifting.
+ */
+void onTriggerIn() {
+  pendingTriggers++;
+}
+
+/**
+ * @brief Adds an entry to the route table. Returns false when the table is full.
+ */
+bool appendRouteTable(const RouteEntry& entry) {
+  if (routeTableLength >= MAX_ROUTE_TABLE) return false;
+  routeTable[routeTableLength++] = entry;
+  return true;
+}
+
+/**
+ * @brief Runs a TABLE_CLEAR or TABLE_ARM command. Returns false for an unknown command or arming an empty table.
+ */
+bool controlRouteTable(uint16_t command) {
+  if (command == TABLE_CLEAR) {
+    routeTableLength = 0;
+    routeTableIndex = -1;
+    return true;
+  }
+  if (command == TABLE_ARM && routeTableLength > 0) {
+    noInterrupts();
+    pendingTriggers = 0; // edges seen before arming do not count
+    interrupts();
+    routeTableIndex = -1;
+    return stepRouteTable();
+  }
+  return false;
+}
+
+/**
+ * @brief Latches the next route table entry and, once the MUXes have settled, pulses SETTLED_OUT_PIN.
+ * Returns false when the table is not armed or already at its last entry.
+ */
+bool stepRouteTable() {
+  if (routeTableLength == 0 || routeTableIndex + 1 >= routeTableLength) return false;
+  routeTableIndex++;
+  const RouteEntry& entry = routeTable[routeTableIndex];
+  applyRoute(entry.be12, entry.be34, entry.enable, entry.te);
+  delayMicroseconds(ROUTE_SETTLE_US);
+  digitalWrite(SETTLED_OUT_PIN, LOW);
+  delayMicroseconds(SETTLED_PULSE_US);
+  digitalWrite(SETTLED_OUT_PIN, HIGH);
+  return true;
+}
+
+/**
+ * @brief Text form of the route table commands, for debugging from the Serial Monitor.
+ */
+void parseTableCommand(String valueInput) {
+  valueInput.trim();
+  bool ok;
+  if (valueInput.startsWith("ADD ")) {
+    RouteEntry entry;
+    if (!parseRouteWords(valueInput.substring(String("ADD ").length()), entry)) return;
+    ok = appendRouteTable(entry);
+  } else if (valueInput == "CLEAR") {
+    ok = controlRouteTable(TABLE_CLEAR);
+  } else if (valueInput == "ARM") {
+    ok = controlRouteTable(TABLE_ARM);
+  } else if (valueInput == "NEXT") {
+    ok = stepRouteTable();
+  } else if (valueInput == "STATUS") {
+    ok = true;
+  } else {
+    Serial.println("Error (TABLE): Unknown table command.");
+    printGeneralUsage();
+    return;
+  }
+  Serial.print(ok ? "TABLE OK" : "Error (TABLE): command failed");
+  Serial.print(" - entries: "); Serial.print(routeTableLength);
+  Serial.print(", current: "); Serial.println(routeTableIndex);
+  printGeneralUsage();
+}
+
 /**
  * @brief Sends 16 bits of data to a specified pair of daisy-chained 74LS595s.
  */
 void write16BitsToChain(int dataPin, int clockPin, int latchPin, uint16_t data) {
+  digitalWrite(latchPin, LOW);
+  shift16Bits(dataPin, clockPin, data);
+  digitalWrite(latchPin, HIGH);
+}
+
+/**
+ * @brief Shifts 16 bits into a pair of 74LS595s without touching the latch.
+ */
+void shift16Bits(int dataPin, int clockPin, uint16_t data) {
   byte highByte = (data >> 8) & 0xFF; // For SR2 (Muxes 3 & 4)
   byte lowByte = data & 0xFF;         // For SR1 (Muxes 1 & 2)
 
-  digitalWrite(latchPin, LOW);
   shiftOut(dataPin, clockPin, MSBFIRST, highByte);
   shiftOut(dataPin, clockPin, MSBFIRST, lowByte);
-  digitalWrite(latchPin, HIGH);
 }
 
 /**